@@ -1,14 +1,37 @@
 """FastAPI main module"""
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from app import routers
+from app.utility.events import broker
+from app.utility.metrics import MetricsMiddleware, instrument_prisma
+from app.utility.pagination import NEXT_CURSOR_HEADER
+from app.utility.responses import FastJSONResponse
+from app.utility.security import password_pool
 from app.utility.setup_db import register_prisma
 
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Connect the Prisma client and start the event broker on startup, and release them on shutdown"""
+    db = await register_prisma()
+    instrument_prisma(db)
+    await broker.start(db)
+    yield
+    await broker.stop()
+    await db.disconnect()
+    password_pool.shutdown()
+
+
 app = FastAPI(
     title="XPense API",
     description="This is the API for XPense",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 app.include_router(routers.router)
 
@@ -18,9 +41,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
-
-register_prisma()
+app.add_middleware(MetricsMiddleware)
 
 
 @app.exception_handler(Exception)
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from . import login, users, images, groups, expenses, transactions
+from . import login, users, images, groups, expenses, transactions, metrics, events, stats
 
 router = APIRouter()
 router.include_router(login.router)
@@ -9,3 +9,6 @@ router.include_router(images.router)
 router.include_router(groups.router)
 router.include_router(expenses.router)
 router.include_router(transactions.router)
+router.include_router(metrics.router)
+router.include_router(events.router)
+router.include_router(stats.router)
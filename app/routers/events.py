@@ -0,0 +1,86 @@
+"""This router is used to stream the events of groups"""
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from prisma.models import GroupMember
+
+from app.utility.events import broker
+from app.utility.membership import get_group_member
+from prisma import get_client
+
+router = APIRouter(tags=["Events"])
+
+# A comment is sent when no event was sent for this long, so proxies keep the connection open
+KEEPALIVE_INTERVAL = 15
+
+# The membership of the subscriber is checked again this often, as a removal may
+# not reach this worker, or may be among the events dropped for a lagging subscriber
+MEMBERSHIP_CHECK_INTERVAL = 15
+
+
+@router.get(
+    "/groups/{group_id}/events",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def get_group_events(
+    group_id: int,
+    group_member: Annotated[GroupMember, Depends(get_group_member)],
+) -> StreamingResponse:
+    """Stream the changes of a group as server-sent events
+
+    A `reset` event means that events were dropped, because the client did not
+    keep up, and ends the stream, so the client should reload the group and
+    reconnect. The stream also ends when the current user is removed from the
+    group.
+    """
+    db = get_client()
+
+    async def is_member() -> bool:
+        """Check if the current user is still a member of the group, bypassing the membership cache"""
+        return (
+            await db.groupmember.find_first(
+                where={"username": group_member.username, "group_id": group_id},
+            )
+            is not None
+        )
+
+    async def stream() -> AsyncIterator[str]:
+        async with broker.subscribe(group_id) as subscription:
+            yield ": connected\n\n"
+            checked_at = time.monotonic()
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), KEEPALIVE_INTERVAL)
+                except TimeoutError:
+                    event = None
+
+                if subscription.take_lagged():
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+
+                if (
+                    event
+                    and event.event_type == "member_removed"
+                    and event.data["username"] == group_member.username
+                ):
+                    yield event.to_sse()
+                    return
+
+                if time.monotonic() - checked_at >= MEMBERSHIP_CHECK_INTERVAL:
+                    if not await is_member():
+                        return
+                    checked_at = time.monotonic()
+
+                yield event.to_sse() if event else ": keepalive\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
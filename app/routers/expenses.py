@@ -1,35 +1,83 @@
 """This router is used to manage expenses"""
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
 
 from prisma import get_client
 from prisma.models import Expense, ExpenseMember
+from prisma.types import ExpenseWhereInput
 from typing import Annotated
 from pydantic import BaseModel
 
-from prisma.models import User
-
-from app.utility.security import get_current_user
+from app.utility.balances import record_expense
+from app.utility.events import GroupEvent, publish_event
+from app.utility.membership import get_group_member
+from app.utility.pagination import Key, Pagination, get_pagination, paginate
+from app.utility.rollups import record_expense_rollup
+from app.utility.search import search_expense_ids
+from app.utility.sequences import allocate_expense_id
+from app.utility.versions import GroupVersion, get_group_version
 
 router = APIRouter(tags=["Expenses"])
 
 
-@router.get("/groups/{group_id}/expenses")
-def get_expenses(group_id: int, current_user: Annotated[User, Depends(get_current_user)]) -> list[Expense]:
+@router.get("/groups/{group_id}/expenses", response_model=list[Expense])
+async def get_expenses(
+    group_id: int,
+    pagination: Annotated[Pagination, Depends(get_pagination)],
+    group_version: Annotated[GroupVersion, Depends(get_group_version)],
+) -> Response:
     """Get all expenses"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
+    async def fetch(after: Key | None, take: int | None) -> list[Expense]:
+        where: ExpenseWhereInput = {"group_id": group_id}
+        if after:
+            where["id"] = {"gt": int(after[0])}
+        return await db.expense.find_many(where=where, order={"id": "asc"}, take=take)
+
+    return await paginate(
+        pagination,
+        fetch,
+        lambda expense: (expense.id, expense.group_id),
+        headers=group_version.headers,
     )
 
-    if not group_member:
-        raise Exception("You are not a member of this group")
 
-    return db.expense.find_many(where={"group_id": group_id})
+# This route is declared before the expense routes, so "search" is not read as an expense id
+@router.get("/groups/{group_id}/expenses/search", response_model=list[Expense])
+async def search_expenses(
+    group_id: int,
+    q: Annotated[
+        str,
+        Query(min_length=1, max_length=200, description="Words to find in the name or description"),
+    ],
+    pagination: Annotated[Pagination, Depends(get_pagination)],
+    group_version: Annotated[GroupVersion, Depends(get_group_version)],
+) -> Response:
+    """Search the expenses of a group by name and description, best match first"""
+    db = get_client()
+
+    # The results are ordered by rank, so the key of an expense is its position in the results
+    positions: dict[int, int] = {}
+
+    async def fetch(after: Key | None, take: int | None) -> list[Expense]:
+        offset = int(after[0]) if after else 0
+        ids = await search_expense_ids(db, group_id, q, offset, take)
+        if not ids:
+            return []
+
+        expenses = {
+            expense.id: expense
+            for expense in await db.expense.find_many(where={"group_id": group_id, "id": {"in": ids}})
+        }
+        positions.update({expense_id: offset + i + 1 for i, expense_id in enumerate(ids)})
+        return [expenses[expense_id] for expense_id in ids if expense_id in expenses]
+
+    return await paginate(
+        pagination,
+        fetch,
+        lambda expense: (positions[expense.id],),
+        headers=group_version.headers,
+    )
 
 
 class CreateMemberModel(BaseModel):
@@ -45,32 +93,20 @@ class CreateExpenseModel(BaseModel):
     members: list[CreateMemberModel]
 
 
-@router.post("/groups/{group_id}/expenses")
-def create_expense(  # noqa: PLR0913
+@router.post("/groups/{group_id}/expenses", dependencies=[Depends(get_group_member)])
+async def create_expense(  # noqa: PLR0913
     group_id: int,
     expense: CreateExpenseModel,
-    current_user: Annotated[User, Depends(get_current_user)],
 ) -> Expense:
     """Create a new expense"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
-    )
-
-    if not group_member:
-        raise Exception("You are not a member of this group")
-
     # Check if the expense amount is equal to the sum of the members
     if sum([member.amount_in_cents for member in expense.members]) != expense.amount_in_cents:
         raise Exception("The expense amount is not equal to the sum of the members")
 
     # Check that all members are part of the group
-    group_members = db.groupmember.find_many(
+    group_members = await db.groupmember.find_many(
         where={
             "username": {"in": [member.username for member in expense.members]},
             "group_id": group_id,
@@ -80,57 +116,65 @@ def create_expense(  # noqa: PLR0913
     if len(group_members) != len(expense.members):
         raise Exception("Not all members are part of the group")
 
-    # We need to get the last id, and increment it by one
-    last_expense = db.expense.find_first(
-        where={"group_id": group_id},
-        order={"id": "desc"},
-    )
-
-    expense_response = db.expense.create(
-        data={
-            "id": last_expense.id + 1 if last_expense else 1,
-            "name": expense.name,
-            "description": expense.description,
-            "amount_in_cents": expense.amount_in_cents,
-            "group_id": group_id,
-            "payer_username": expense.payer_username,
-        },
-    )
-
-    for member in expense.members:
-        db.expensemember.create(
+    # The expense, its members, the ledger and the rollup are written in one transaction.
+    # The members are created by a nested write, so the expense and all of its
+    # members are inserted by a single query.
+    async with db.tx() as tx:
+        expense_response = await tx.expense.create(
             data={
-                "username": member.username,
-                "expense_id": expense_response.id,
+                "id": await allocate_expense_id(tx, group_id),
+                "name": expense.name,
+                "description": expense.description,
+                "amount_in_cents": expense.amount_in_cents,
                 "group_id": group_id,
-                "amount_in_cents": member.amount_in_cents,
+                "payer_username": expense.payer_username,
+                "ExpenseMember": {
+                    "create": [
+                        {
+                            "username": member.username,
+                            "amount_in_cents": member.amount_in_cents,
+                        }
+                        for member in expense.members
+                    ],
+                },
             },
         )
 
+        shares = {member.username: member.amount_in_cents for member in expense.members}
+        await record_expense(tx, group_id, expense.payer_username, expense.amount_in_cents, shares)
+        await record_expense_rollup(
+            tx,
+            group_id,
+            expense_response.date,
+            expense.payer_username,
+            expense.amount_in_cents,
+            shares,
+        )
+
+    await publish_event(
+        GroupEvent(
+            event_type="expense_created",
+            group_id=group_id,
+            data={
+                "id": expense_response.id,
+                "payer_username": expense_response.payer_username,
+                "amount_in_cents": expense_response.amount_in_cents,
+            },
+        ),
+    )
+
     return expense_response
 
 
-@router.get("/groups/{group_id}/expenses/{expense_id}")
-def get_expense(
+@router.get("/groups/{group_id}/expenses/{expense_id}", dependencies=[Depends(get_group_version)])
+async def get_expense(
     group_id: int,
     expense_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
 ) -> Expense:
     """Get a specific expense"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
-    )
-
-    if not group_member:
-        raise Exception("You are not a member of this group")
-
-    expense = db.expense.find_first(
+    expense = await db.expense.find_first(
         where={
             "group_id": group_id,
             "id": expense_id,
@@ -143,27 +187,18 @@ def get_expense(
     return expense
 
 
-@router.get("/groups/{group_id}/expenses/{expense_id}/members")
-def get_expense_members(
+@router.get(
+    "/groups/{group_id}/expenses/{expense_id}/members",
+    dependencies=[Depends(get_group_version)],
+)
+async def get_expense_members(
     group_id: int,
     expense_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
 ) -> list[ExpenseMember]:
     """Get all expense members"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
-    )
-
-    if not group_member:
-        raise Exception("You are not a member of this group")
-
-    expense = db.expense.find_first(
+    expense = await db.expense.find_first(
         where={
             "group_id": group_id,
             "id": expense_id,
@@ -173,7 +208,7 @@ def get_expense_members(
     if not expense:
         raise Exception("Expense not found")
 
-    return db.expensemember.find_many(
+    return await db.expensemember.find_many(
         where={
             "group_id": group_id,
             "expense_id": expense_id,
@@ -1,10 +1,19 @@
 """This router is used to get the groups"""
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
-from prisma.models import User, Group, GroupMember as GroupMemberModel
+from fastapi import APIRouter, Depends, Query, Response
+from prisma.models import Currency, Expense, Group, GroupMember as GroupMemberModel, Transaction
+from prisma.partials import AuthenticatedUser
+from prisma.types import GroupMemberWhereInput
 from pydantic import BaseModel
+from app.utility.balances import Settlement, get_group_total, get_ledger, settle
+from app.utility.cache import TTLCache
+from app.utility.events import GroupEvent, publish_event
+from app.utility.membership import get_group_owner, invalidate_membership
+from app.utility.pagination import MAX_PAGE_SIZE, Key, Pagination, get_pagination, paginate
+from app.utility.responses import FastJSONResponse
 from app.utility.security import get_current_user
+from app.utility.versions import GroupVersion, bump_group_version, get_group_version
 from prisma import get_client
 
 router = APIRouter(tags=["Groups"])
@@ -16,30 +25,40 @@ class GroupMember(GroupMemberModel):
     balance_amount_cents: int
 
 
-@router.get("/groups", operation_id="get_groups")
-def get_groups(current_user: Annotated[User, Depends(get_current_user)]) -> list[Group]:
+@router.get("/groups", operation_id="get_groups", response_model=list[Group])
+async def get_groups(
+    current_user: Annotated[AuthenticatedUser, Depends(get_current_user)],
+    pagination: Annotated[Pagination, Depends(get_pagination)],
+) -> Response:
     """Get all groups where the user is a member of"""
     db = get_client()
 
-    group_members = db.groupmember.find_many(
-        where={"username": current_user.username},
-        include={"group": True},
-    )
+    async def fetch(after: Key | None, take: int | None) -> list[Group]:
+        where: GroupMemberWhereInput = {"username": current_user.username}
+        if after:
+            where["group_id"] = {"gt": int(after[0])}
+        group_members = await db.groupmember.find_many(
+            where=where,
+            include={"group": True},
+            order={"group_id": "asc"},
+            take=take,
+        )
+        return [group_member.group for group_member in group_members if group_member.group]
 
-    return [group_member.group for group_member in group_members]
+    return await paginate(pagination, fetch, lambda group: (group.id,))
 
 
 @router.post("/groups", operation_id="create_group")
-def create_group(
+async def create_group(
     name: str,
     description: str,
     currency_code: str,
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[AuthenticatedUser, Depends(get_current_user)],
 ) -> Group:
     """Create a new group"""
     db = get_client()
 
-    group = db.group.create(
+    group = await db.group.create(
         data={
             "name": name,
             "description": description,
@@ -47,7 +66,7 @@ def create_group(
         },
     )
 
-    db.groupmember.create(
+    await db.groupmember.create(
         data={
             "username": current_user.username,
             "group_id": group.id,
@@ -58,137 +77,141 @@ def create_group(
     return group
 
 
-@router.get("/groups/{group_id}", operation_id="get_group")
-def get_group(group_id: int, current_user: Annotated[User, Depends(get_current_user)]) -> Group:
+@router.get("/groups/{group_id}", operation_id="get_group", dependencies=[Depends(get_group_version)])
+async def get_group(
+    group_id: int,
+) -> Group:
     """Get a specific group"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
-    )
-
-    if not group_member:
-        raise Exception("You are not a member of this group")
+    return await db.group.find_first(where={"id": group_id})
 
-    return db.group.find_first(where={"id": group_id})
 
-
-@router.get("/groups/{group_id}/members", operation_id="get_group_members")
-def get_group_members(
+@router.get(
+    "/groups/{group_id}/members",
+    operation_id="get_group_members",
+    response_model=list[GroupMember],
+)
+async def get_group_members(
     group_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-) -> list[GroupMember]:
+    group_version: Annotated[GroupVersion, Depends(get_group_version)],
+) -> Response:
     """Get all members of a group"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
-    )
-
-    if not group_member:
-        raise Exception("You are not a member of this group")
+    # Read the balance of each member from the ledger
+    ledger = await get_ledger(db, group_id)
 
     group_members = [
-        group_member.dict() for group_member in db.groupmember.find_many(where={"group_id": group_id})
+        member.model_dump() for member in await db.groupmember.find_many(where={"group_id": group_id})
     ]
 
-    # Calculate the balance of each member
     for member in group_members:
-        member["balance_amount_cents"] = 0
+        balance = ledger.get(member["username"])
+        member["balance_amount_cents"] = balance.balance_amount_cents if balance else 0
 
-        for expense in db.expense.find_many(where={"group_id": group_id}):
-            if expense.payer_username == member["username"]:
-                member["balance_amount_cents"] += expense.amount_in_cents
+    return FastJSONResponse(group_members, headers=group_version.headers)
 
-            expense_member = db.expensemember.find_first(
-                where={
-                    "expense_id": expense.id,
-                    "group_id": group_id,
-                    "username": member["username"],
-                },
-            )
 
-            if expense_member:
-                member["balance_amount_cents"] -= expense_member.amount_in_cents
+# Settlements by group id, with the version of the group when they were computed.
+# The version increases with every write to the group, in every worker.
+settlement_cache: TTLCache[int, tuple[int, list[Settlement]]] = TTLCache(
+    "settlements",
+    max_size=1024,
+    ttl=3600,
+)
+
+
+@router.get("/groups/{group_id}/settlement", operation_id="get_group_settlement")
+async def get_group_settlement(
+    group_id: int,
+    group_version: Annotated[GroupVersion, Depends(get_group_version)],
+) -> list[Settlement]:
+    """Get the transfers which settle every balance of a group"""
+    db = get_client()
+
+    version = group_version.version
+    cached = settlement_cache.get(group_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    # The group itself holds what its members transferred to it
+    ledger = await get_ledger(db, group_id)
+    balances: dict[str | None, int] = {
+        username: balance.balance_amount_cents for username, balance in ledger.items()
+    }
+    balances[None] = -sum(balance.transferred_amount_cents for balance in ledger.values())
 
-        for transaction in db.transaction.find_many(
-            where={"group_id": group_id, "username": member["username"]}
-        ):
-            member["balance_amount_cents"] += transaction.amount_in_cents
+    settlements = settle(balances)
+    settlement_cache.put(group_id, (version, settlements))
 
-    return group_members
+    return settlements
 
 
-@router.post("/groups/{group_id}/members", operation_id="add_group_member")
-def add_group_member(
+@router.post(
+    "/groups/{group_id}/members",
+    operation_id="add_group_member",
+    dependencies=[Depends(get_group_owner)],
+)
+async def add_group_member(
     group_id: int,
     username: str,
     is_owner: bool,
-    current_user: Annotated[User, Depends(get_current_user)],
 ) -> list[GroupMemberModel]:
     """Add a user to a group"""
     db = get_client()
 
-    # Check if the current user is the owner of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-            "is_owner": True,
-        },
+    async with db.tx() as tx:
+        await tx.groupmember.create(
+            data={
+                "username": username,
+                "group_id": group_id,
+                "is_owner": is_owner,
+            },
+        )
+        await bump_group_version(tx, group_id)
+
+    invalidate_membership(username, group_id)
+    await publish_event(
+        GroupEvent(
+            event_type="member_added",
+            group_id=group_id,
+            data={"username": username, "is_owner": is_owner},
+        ),
     )
 
-    if not group_member:
-        raise Exception("You are not the owner of this group")
+    return await db.groupmember.find_many(where={"group_id": group_id})
 
-    db.groupmember.create(
-        data={
-            "username": username,
-            "group_id": group_id,
-            "is_owner": is_owner,
-        },
-    )
-
-    return db.groupmember.find_many(where={"group_id": group_id})
 
-
-@router.delete("/groups/{group_id}/members/{username}", operation_id="remove_group_member")
-def remove_group_member(
+@router.delete(
+    "/groups/{group_id}/members/{username}",
+    operation_id="remove_group_member",
+    dependencies=[Depends(get_group_owner)],
+)
+async def remove_group_member(
     group_id: int,
     username: str,
-    current_user: Annotated[User, Depends(get_current_user)],
 ) -> list[GroupMember]:
     """Remove a user from a group"""
     db = get_client()
 
-    # Check if the current user is the owner of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-            "is_owner": True,
-        },
-    )
-
-    if not group_member:
-        raise Exception("You are not the owner of this group")
+    async with db.tx() as tx:
+        await tx.groupmember.delete(
+            where={
+                "group_id_username": {
+                    "username": username,
+                    "group_id": group_id,
+                },
+            },
+        )
+        await bump_group_version(tx, group_id)
 
-    db.groupmember.delete(
-        where={
-            "username": username,
-            "group_id": group_id,
-        },
+    invalidate_membership(username, group_id)
+    await publish_event(
+        GroupEvent(event_type="member_removed", group_id=group_id, data={"username": username}),
     )
 
-    return db.groupmember.find_many(where={"group_id": group_id})
+    return await db.groupmember.find_many(where={"group_id": group_id})
 
 
 class GroupBalance(BaseModel):
@@ -197,28 +220,88 @@ class GroupBalance(BaseModel):
     balance_amount_cents: int
 
 
-@router.get("/groups/{group_id}/balance", operation_id="get_group_balance")
-def get_group_balance(
+@router.get(
+    "/groups/{group_id}/balance",
+    operation_id="get_group_balance",
+    dependencies=[Depends(get_group_version)],
+)
+async def get_group_balance(
     group_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
 ) -> GroupBalance:
     """Get the balance of a group"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
-    )
+    return GroupBalance(balance_amount_cents=await get_group_total(db, group_id))
+
+
+class GroupOverview(BaseModel):
+    """GroupOverview model"""
+
+    group: Group
+    currency: Currency
+    members: list[GroupMember]
+    recent_expenses: list[Expense]
+    recent_transactions: list[Transaction]
+    balance_amount_cents: int
 
-    if not group_member:
-        raise Exception("You are not a member of this group")
 
-    group_balance = GroupBalance(balance_amount_cents=0)
+@router.get(
+    "/groups/{group_id}/overview",
+    operation_id="get_group_overview",
+    response_model=GroupOverview,
+)
+async def get_group_overview(
+    group_id: int,
+    group_version: Annotated[GroupVersion, Depends(get_group_version)],
+    recent: Annotated[
+        int,
+        Query(ge=0, le=MAX_PAGE_SIZE, description="Number of recent expenses and transactions"),
+    ] = 10,
+) -> Response:
+    """Get a group with its currency, member balances, recent expenses and transactions, and total"""
+    db = get_client()
 
-    for transaction in db.transaction.find_many(where={"group_id": group_id}):
-        group_balance.balance_amount_cents += transaction.amount_in_cents
+    # Everything is read by a single query, which includes the related rows of the group
+    group = await db.group.find_unique(
+        where={"id": group_id},
+        include={
+            "currency": True,
+            "GroupMember": True,
+            "MemberBalance": True,
+            "Expense": {"take": recent, "order_by": {"id": "desc"}},
+            "Transaction": {"take": recent, "order_by": {"id": "desc"}},
+        },
+    )
+    if not group or not group.currency:
+        raise Exception("Group not found")
+
+    ledger = {balance.username: balance for balance in group.MemberBalance or []}
+    members = []
+    for member in group.GroupMember or []:
+        balance = ledger.get(member.username)
+        members.append(
+            GroupMember(
+                **member.model_dump(),
+                balance_amount_cents=balance.balance_amount_cents if balance else 0,
+            ),
+        )
+
+    overview = GroupOverview(
+        group=group.model_copy(
+            update={
+                "currency": None,
+                "GroupMember": None,
+                "MemberBalance": None,
+                "Expense": None,
+                "Transaction": None,
+            },
+        ),
+        currency=group.currency,
+        members=members,
+        recent_expenses=group.Expense or [],
+        recent_transactions=group.Transaction or [],
+        # The group holds what its members transferred to it
+        balance_amount_cents=sum(balance.transferred_amount_cents for balance in ledger.values()),
+    )
 
-    return group_balance
+    return FastJSONResponse(overview, headers=group_version.headers)
@@ -1,29 +1,72 @@
 """This router is used to get the images"""
-from fastapi import APIRouter, Response
+from typing import Annotated
 
-from prisma import get_client
-from prisma.models import Image
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from fastapi.responses import FileResponse
+
+from prisma.partials import ImageMetadata
+
+from app.utility.blobs import blob_store
+from app.utility.cache import TTLCache
+from app.utility.http_cache import etag_matches
+from app.utility.pagination import Key, Pagination, get_pagination, paginate
 
 router = APIRouter(tags=["Images"])
 
 
-@router.get("/images", summary="Get Images", response_model_exclude_none=True)
-def get_images() -> list[Image]:
-    """Get all images"""
-    db = get_client()
-    images = db.image.find_many()
-    for image in images:
-        del image.data
-    return images
+@router.get(
+    "/images",
+    summary="Get Images",
+    response_model=list[ImageMetadata],
+)
+async def get_images(
+    pagination: Annotated[Pagination, Depends(get_pagination)],
+) -> Response:
+    """Get the metadata of all images, without their data"""
+
+    async def fetch(after: Key | None, take: int | None) -> list[ImageMetadata]:
+        # The partial model only selects its own columns, so the data is never read
+        return await ImageMetadata.prisma().find_many(
+            where={"name": {"gt": str(after[0])}} if after else None,
+            order={"name": "asc"},
+            take=take,
+        )
+
+    return await paginate(pagination, fetch, lambda image: (image.name,))
+
+
+# Profile images almost never change, so clients may reuse them for a day before
+# revalidating them with their ETag
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+
+# The metadata of images by name, so revalidating an image does not query the database
+image_cache: TTLCache[str, ImageMetadata] = TTLCache("images", max_size=4096, ttl=3600)
 
 
 @router.get(
     "/images/{image_name}",
-    responses={200: {"content": {"image/png": {}}}},
+    responses={200: {"content": {"image/*": {}}}, 304: {}, 404: {}},
     response_class=Response,
 )
-def get_image(image_name: str) -> Response:
+async def get_image(
+    image_name: str,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Response:
     """Get specific image"""
-    db = get_client()
-    image_data = db.image.find_first(where={"name": image_name}).data.decode()
-    return Response(content=image_data, media_type="image/png")
+    image = image_cache.get(image_name)
+
+    if image is None:
+        image = await ImageMetadata.prisma().find_unique(where={"name": image_name})
+        if not image or not blob_store.exists(image.content_hash):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+        image_cache.put(image_name, image)
+
+    # The blob of an image is named by its hash, so the hash identifies its content
+    etag = f'"{image.content_hash}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # The file is streamed from disk, so the image never has to be read into memory at once
+    return FileResponse(blob_store.path(image.content_hash), media_type=image.mime_type, headers=headers)
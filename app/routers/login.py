@@ -4,16 +4,24 @@ from typing import Annotated
 from fastapi import APIRouter, Depends, Form, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from prisma.models import Token, User
-from app.utility.security import authenticate_user, create_access_token, get_password_hash, get_current_user
+from prisma.partials import AuthenticatedUser
+from app.utility.security import (
+    authenticate_user,
+    create_access_token,
+    get_current_user,
+    get_password_hash,
+    password_pool,
+    user_cache,
+)
 from prisma import get_client
 
 router = APIRouter(tags=["Login"])
 
 
 @router.post("/token")
-def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
+async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
     """Login for access token"""
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -26,7 +34,7 @@ def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
 
 
 @router.post("/signup")
-def signup(
+async def signup(
     username: Annotated[str, Form()],
     email: Annotated[str, Form()],
     full_name: Annotated[str, Form()],
@@ -36,12 +44,12 @@ def signup(
     """Signup for access token"""
     db = get_client()
 
-    db.user.create(
+    await db.user.create(
         {
             "username": username,
             "email": email,
             "full_name": full_name,
-            "hashed_password": get_password_hash(password),
+            "hashed_password": await password_pool.run(get_password_hash, password),
             "profile_image_name": profile_image,
         },
     )
@@ -56,12 +64,12 @@ def signup(
 
 # Support updating the user's profile data
 @router.put("/users/{username}")
-def update_user(  # noqa: PLR0913
+async def update_user(  # noqa: PLR0913
     username: str,
     email: Annotated[str, Form()],
     full_name: Annotated[str, Form()],
     profile_image: Annotated[str, Form()],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[AuthenticatedUser, Depends(get_current_user)],
 ) -> User:
     """Update a user's profile data"""
     db = get_client()
@@ -70,7 +78,7 @@ def update_user(  # noqa: PLR0913
     if current_user.username != username:
         raise Exception("You can only update your own profile")
 
-    db.user.update(
+    await db.user.update(
         where={"username": username},
         data={
             "email": email,
@@ -79,4 +87,7 @@ def update_user(  # noqa: PLR0913
         },
     )
 
-    return db.user.find_first(where={"username": username})
+    # Drop the cached user, so the next request sees the new profile data
+    user_cache.invalidate(username)
+
+    return await db.user.find_first(where={"username": username})
@@ -0,0 +1,13 @@
+"""This router is used to expose the metrics"""
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.utility.metrics import render_metrics
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """Get the metrics of this worker in the Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
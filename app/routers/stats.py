@@ -0,0 +1,96 @@
+"""This router is used to get the spending statistics of groups"""
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Query
+from prisma.types import MonthlySpendingWhereInput, StringFilter
+from pydantic import BaseModel
+
+from prisma import get_client
+
+from app.utility.rollups import MONTH_PATTERN
+from app.utility.versions import get_group_version
+
+router = APIRouter(tags=["Stats"])
+
+
+class MemberSpending(BaseModel):
+    """What a member paid for expenses, and their share of the expenses"""
+
+    username: str
+    paid_amount_cents: int = 0
+    owed_amount_cents: int = 0
+
+
+class MonthlyStats(BaseModel):
+    """The spending of a group in a month"""
+
+    month: str
+    amount_in_cents: int
+    members: list[MemberSpending]
+
+
+class GroupStats(BaseModel):
+    """The spending of a group in a range of months, in total and per month"""
+
+    amount_in_cents: int
+    members: list[MemberSpending]
+    months: list[MonthlyStats]
+
+
+@router.get(
+    "/groups/{group_id}/stats",
+    operation_id="get_group_stats",
+    dependencies=[Depends(get_group_version)],
+)
+async def get_group_stats(
+    group_id: int,
+    from_month: Annotated[
+        str | None,
+        Query(pattern=MONTH_PATTERN, description="First month, as YYYY-MM"),
+    ] = None,
+    to_month: Annotated[
+        str | None,
+        Query(pattern=MONTH_PATTERN, description="Last month, as YYYY-MM"),
+    ] = None,
+) -> GroupStats:
+    """Get the spending per member and month of a group, and per member over the months
+
+    The statistics are read from the monthly rollup rows, so the cost depends
+    on the number of months and members, not on the number of expenses.
+    """
+    db = get_client()
+
+    where: MonthlySpendingWhereInput = {"group_id": group_id}
+    month_filter: StringFilter = {}
+    if from_month:
+        month_filter["gte"] = from_month
+    if to_month:
+        month_filter["lte"] = to_month
+    if month_filter:
+        where["month"] = month_filter
+
+    rows = await db.monthlyspending.find_many(where=where, order=[{"month": "asc"}, {"username": "asc"}])
+
+    totals: dict[str, MemberSpending] = {}
+    months: dict[str, MonthlyStats] = {}
+    for row in rows:
+        month = months.setdefault(row.month, MonthlyStats(month=row.month, amount_in_cents=0, members=[]))
+        month.members.append(
+            MemberSpending(
+                username=row.username,
+                paid_amount_cents=row.paid_amount_cents,
+                owed_amount_cents=row.owed_amount_cents,
+            ),
+        )
+        # Every expense is paid by a single member
+        month.amount_in_cents += row.paid_amount_cents
+
+        total = totals.setdefault(row.username, MemberSpending(username=row.username))
+        total.paid_amount_cents += row.paid_amount_cents
+        total.owed_amount_cents += row.owed_amount_cents
+
+    return GroupStats(
+        amount_in_cents=sum(month.amount_in_cents for month in months.values()),
+        members=sorted(totals.values(), key=lambda total: total.username),
+        months=list(months.values()),
+    )
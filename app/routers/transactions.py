@@ -1,96 +1,94 @@
 """This router is used to manage transactions"""
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 
 from prisma import get_client
-from prisma.models import Transaction
+from prisma.models import GroupMember, Transaction
+from prisma.types import TransactionWhereInput
 from typing import Annotated
 
-from prisma.models import User
-
-from app.utility.security import get_current_user
-from app.routers.groups import get_group_members, get_group_balance
+from app.utility.balances import get_group_total, record_transaction
+from app.utility.events import GroupEvent, publish_event
+from app.utility.membership import get_group_member
+from app.utility.pagination import Key, Pagination, get_pagination, paginate
+from app.utility.sequences import allocate_transaction_id
+from app.utility.versions import GroupVersion, get_group_version
 
 router = APIRouter(tags=["Transactions"])
 
 
-@router.get("/groups/{group_id}/transactions")
-def get_transactions(
-    group_id: int, current_user: Annotated[User, Depends(get_current_user)]
-) -> list[Transaction]:
+@router.get("/groups/{group_id}/transactions", response_model=list[Transaction])
+async def get_transactions(
+    group_id: int,
+    pagination: Annotated[Pagination, Depends(get_pagination)],
+    group_version: Annotated[GroupVersion, Depends(get_group_version)],
+) -> Response:
     """Get all transactions"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
+    async def fetch(after: Key | None, take: int | None) -> list[Transaction]:
+        where: TransactionWhereInput = {"group_id": group_id}
+        if after:
+            where["id"] = {"gt": int(after[0])}
+        return await db.transaction.find_many(where=where, order={"id": "asc"}, take=take)
+
+    return await paginate(
+        pagination,
+        fetch,
+        lambda transaction: (transaction.id, transaction.group_id),
+        headers=group_version.headers,
     )
 
-    if not group_member:
-        raise Exception("You are not a member of this group")
-
-    return db.transaction.find_many(where={"group_id": group_id})
-
 
 @router.post("/groups/{group_id}/transactions")
-def create_transaction(
+async def create_transaction(
     group_id: int,
     amount_in_cents: int,
-    current_user: Annotated[User, Depends(get_current_user)],
+    group_member: Annotated[GroupMember, Depends(get_group_member)],
 ) -> Transaction:
     """Create a new transaction"""
     db = get_client()
 
-    # Check if the current user is a member of the group
-    group_member = db.groupmember.find_first(
-        where={
-            "username": current_user.username,
-            "group_id": group_id,
-        },
-    )
-
-    if not group_member:
-        raise Exception("You are not a member of this group")
-
-    # Check if the the group balance permits the transaction
-    group_members = get_group_members(group_id, current_user)
-    current_group_member = next(
-        (member for member in group_members if member["username"] == current_user.username),
-        None,
-    )
-
-    if not current_group_member:
-        raise Exception("You are not a member of this group")
-
     if amount_in_cents == 0:
         raise Exception("You cannot make a transaction of 0")
 
-    if amount_in_cents < 0:
-        # Withdrawing money
-        if current_group_member["balance_amount_cents"] + amount_in_cents < 0:
-            raise Exception("You cannot withdraw more than your balance")
-
-        if get_group_balance(group_id, current_user).balance_amount_cents + amount_in_cents < 0:
-            raise Exception("You cannot withdraw more than the group balance")
-
-    else:  # noqa: PLR5501
-        # Depositing money
-        if current_group_member["balance_amount_cents"] + amount_in_cents > 0:
-            raise Exception("You cannot deposit more than what you owe")
-
-    # We need to get the last id, and increment it by one
-    last_transaction = db.transaction.find_first(
-        where={"group_id": group_id},
-        order={"id": "desc"},
+    async with db.tx() as tx:
+        # Update the ledger first, which takes the write lock, and validate the
+        # resulting balances. Raising here rolls the whole transaction back, so
+        # no other write can slip in between the check and the insert.
+        balance = await record_transaction(tx, group_id, group_member.username, amount_in_cents)
+
+        if amount_in_cents < 0:
+            # Withdrawing money
+            if balance.balance_amount_cents < 0:
+                raise Exception("You cannot withdraw more than your balance")
+
+            if await get_group_total(tx, group_id) < 0:
+                raise Exception("You cannot withdraw more than the group balance")
+
+        else:  # noqa: PLR5501
+            # Depositing money
+            if balance.balance_amount_cents > 0:
+                raise Exception("You cannot deposit more than what you owe")
+
+        transaction = await tx.transaction.create(
+            data={
+                "id": await allocate_transaction_id(tx, group_id),
+                "group_id": group_id,
+                "amount_in_cents": amount_in_cents,
+                "username": group_member.username,
+            },
+        )
+
+    await publish_event(
+        GroupEvent(
+            event_type="transaction_created",
+            group_id=group_id,
+            data={
+                "id": transaction.id,
+                "username": transaction.username,
+                "amount_in_cents": transaction.amount_in_cents,
+            },
+        ),
     )
 
-    return db.transaction.create(
-        data={
-            "id": last_transaction.id + 1 if last_transaction else 1,
-            "group_id": group_id,
-            "amount_in_cents": amount_in_cents,
-            "username": current_user.username,
-        },
-    )
+    return transaction
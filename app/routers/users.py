@@ -1,9 +1,13 @@
 """This router is used to get the users"""
+from collections import defaultdict
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from prisma.models import User
+from prisma.partials import AuthenticatedUser
+from pydantic import BaseModel
 
+from app.utility.pagination import Key, Pagination, get_pagination, paginate
 from app.utility.security import get_current_user
 from prisma import get_client
 
@@ -11,13 +15,94 @@ router = APIRouter(tags=["Users"])
 
 
 @router.get("/current_user")
-def current_user(current_user: Annotated[User, Depends(get_current_user)]) -> User:
+async def current_user(
+    current_user: Annotated[AuthenticatedUser, Depends(get_current_user)],
+) -> AuthenticatedUser:
     """Get the current user"""
     return current_user
 
 
-@router.get("/users", operation_id="get_users")
-def users() -> list[User]:
+class UserGroupBalance(BaseModel):
+    """The balance of the current user in a group"""
+
+    group_id: int
+    group_name: str
+    currency_code: str
+    balance_amount_cents: int
+
+
+class UserCurrencyBalance(BaseModel):
+    """The balance of the current user over every group with a currency"""
+
+    currency_code: str
+    balance_amount_cents: int
+
+
+class UserBalances(BaseModel):
+    """The balances of the current user, per group and per currency"""
+
+    groups: list[UserGroupBalance]
+    currencies: list[UserCurrencyBalance]
+
+
+@router.get("/current_user/balances", operation_id="get_current_user_balances")
+async def current_user_balances(
+    current_user: Annotated[AuthenticatedUser, Depends(get_current_user)],
+) -> UserBalances:
+    """Get the balance of the current user in every group they are a member of, and per currency
+
+    The memberships, groups and ledger rows of the user are read by a single
+    query, no matter how many groups the user is a member of.
+    """
+    db = get_client()
+
+    group_members = await db.groupmember.find_many(
+        where={"username": current_user.username},
+        include={
+            "group": {"include": {"MemberBalance": {"where": {"username": current_user.username}}}},
+        },
+        order={"group_id": "asc"},
+    )
+
+    groups = []
+    currencies: defaultdict[str, int] = defaultdict(int)
+    for group_member in group_members:
+        group = group_member.group
+        if not group:
+            continue
+
+        balance_amount_cents = sum(balance.balance_amount_cents for balance in group.MemberBalance or [])
+        groups.append(
+            UserGroupBalance(
+                group_id=group.id,
+                group_name=group.name,
+                currency_code=group.currency_code,
+                balance_amount_cents=balance_amount_cents,
+            ),
+        )
+        currencies[group.currency_code] += balance_amount_cents
+
+    return UserBalances(
+        groups=groups,
+        currencies=[
+            UserCurrencyBalance(currency_code=currency_code, balance_amount_cents=balance_amount_cents)
+            for currency_code, balance_amount_cents in sorted(currencies.items())
+        ],
+    )
+
+
+@router.get("/users", operation_id="get_users", response_model=list[User])
+async def users(
+    pagination: Annotated[Pagination, Depends(get_pagination)],
+) -> Response:
     """Get all users"""
     db = get_client()
-    return db.user.find_many()
+
+    async def fetch(after: Key | None, take: int | None) -> list[User]:
+        return await db.user.find_many(
+            where={"username": {"gt": str(after[0])}} if after else None,
+            order={"username": "asc"},
+            take=take,
+        )
+
+    return await paginate(pagination, fetch, lambda user: (user.username,))
@@ -0,0 +1,176 @@
+"""Balance utilities, which aggregate and maintain the ledger of a group"""
+import heapq
+from collections import defaultdict
+from typing import Any
+
+from prisma.models import MemberBalance
+from pydantic import BaseModel
+
+from prisma import Prisma
+
+
+class MemberTotals(BaseModel):
+    """The totals of a user in a group, computed from the raw rows"""
+
+    paid_amount_cents: int = 0
+    owed_amount_cents: int = 0
+    transferred_amount_cents: int = 0
+
+    @property
+    def balance_amount_cents(self) -> int:
+        """What the user paid, minus their share, plus what they transferred"""
+        return self.paid_amount_cents - self.owed_amount_cents + self.transferred_amount_cents
+
+
+async def get_member_totals(db: Prisma, group_id: int) -> dict[str, MemberTotals]:
+    """Get the totals of every user with activity in a group
+
+    Each of the paid, owed and transferred totals is computed with a single
+    GROUP BY query, so the cost does not depend on the number of members or
+    expenses.
+    """
+    totals: defaultdict[str, MemberTotals] = defaultdict(MemberTotals)
+
+    paid = await db.expense.group_by(
+        by=["payer_username"],
+        where={"group_id": group_id},
+        sum={"amount_in_cents": True},
+    )
+    for row in paid:
+        totals[row["payer_username"]].paid_amount_cents = row["_sum"]["amount_in_cents"] or 0
+
+    owed = await db.expensemember.group_by(
+        by=["username"],
+        where={"group_id": group_id},
+        sum={"amount_in_cents": True},
+    )
+    for row in owed:
+        totals[row["username"]].owed_amount_cents = row["_sum"]["amount_in_cents"] or 0
+
+    transferred = await db.transaction.group_by(
+        by=["username"],
+        where={"group_id": group_id},
+        sum={"amount_in_cents": True},
+    )
+    for row in transferred:
+        totals[row["username"]].transferred_amount_cents = row["_sum"]["amount_in_cents"] or 0
+
+    return dict(totals)
+
+
+async def get_ledger(db: Prisma, group_id: int) -> dict[str, MemberBalance]:
+    """Get the ledger rows of a group, keyed by username"""
+    return {row.username: row for row in await db.memberbalance.find_many(where={"group_id": group_id})}
+
+
+async def get_group_total(db: Prisma, group_id: int) -> int:
+    """Get the amount currently held by a group, which is the sum of all transfers"""
+    rows = await db.memberbalance.group_by(
+        by=["group_id"],
+        where={"group_id": group_id},
+        sum={"transferred_amount_cents": True},
+    )
+    return (rows[0]["_sum"]["transferred_amount_cents"] or 0) if rows else 0
+
+
+def _increment_args(
+    group_id: int,
+    username: str,
+    balance_amount_cents: int,
+    transferred_amount_cents: int = 0,
+) -> dict[str, Any]:
+    """Get the upsert arguments which add to the ledger row of a user, creating it if needed"""
+    return {
+        "where": {"group_id_username": {"group_id": group_id, "username": username}},
+        "data": {
+            "create": {
+                "group_id": group_id,
+                "username": username,
+                "balance_amount_cents": balance_amount_cents,
+                "transferred_amount_cents": transferred_amount_cents,
+            },
+            "update": {
+                "balance_amount_cents": {"increment": balance_amount_cents},
+                "transferred_amount_cents": {"increment": transferred_amount_cents},
+            },
+        },
+    }
+
+
+async def record_expense(
+    db: Prisma,
+    group_id: int,
+    payer_username: str,
+    amount_in_cents: int,
+    shares: dict[str, int],
+) -> None:
+    """Update the ledger for a new expense
+
+    This should be called with a transaction client, so the ledger is updated
+    atomically with the expense itself.
+    """
+    deltas: defaultdict[str, int] = defaultdict(int)
+    deltas[payer_username] += amount_in_cents
+    for username, share in shares.items():
+        deltas[username] -= share
+
+    # All rows are upserted in a single batch, so a wide split costs one round trip
+    async with db.batch_() as batcher:
+        for username, delta in deltas.items():
+            batcher.memberbalance.upsert(**_increment_args(group_id, username, delta))
+
+
+async def record_transaction(db: Prisma, group_id: int, username: str, amount_in_cents: int) -> MemberBalance:
+    """Update the ledger for a new transaction, and return the updated row
+
+    This should be called with a transaction client, so the ledger is updated
+    atomically with the transaction itself.
+    """
+    return await db.memberbalance.upsert(
+        **_increment_args(group_id, username, amount_in_cents, amount_in_cents),
+    )
+
+
+class Settlement(BaseModel):
+    """A transfer which settles part of the balances of a group
+
+    A missing username is the group itself, which holds the money that members
+    have transferred to it.
+    """
+
+    from_username: str | None
+    to_username: str | None
+    amount_in_cents: int
+
+
+def settle(balances: dict[str | None, int]) -> list[Settlement]:
+    """Get transfers which bring every balance to zero, the balances must sum to zero
+
+    The largest debtor repeatedly pays the largest creditor, which settles at
+    least one of the two with every transfer. This takes O(n log n) time and
+    needs at most n - 1 transfers.
+    """
+    # Heaps of (-amount, tiebreak, username), so the largest amount is popped first
+    debtors = [
+        (balance, i, username) for i, (username, balance) in enumerate(balances.items()) if balance < 0
+    ]
+    creditors = [
+        (-balance, i, username) for i, (username, balance) in enumerate(balances.items()) if balance > 0
+    ]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    settlements = []
+    while debtors and creditors:
+        debt, debtor_i, debtor = heapq.heappop(debtors)
+        credit, creditor_i, creditor = heapq.heappop(creditors)
+        amount = min(-debt, -credit)
+
+        settlements.append(Settlement(from_username=debtor, to_username=creditor, amount_in_cents=amount))
+
+        if debt + amount < 0:
+            heapq.heappush(debtors, (debt + amount, debtor_i, debtor))
+        if credit + amount < 0:
+            heapq.heappush(creditors, (credit + amount, creditor_i, creditor))
+
+    return settlements
@@ -0,0 +1,56 @@
+"""Blob utilities, which implement a content addressed store of files on disk"""
+import hashlib
+import os
+import pathlib
+import tempfile
+
+import app
+
+# The directory of the blob store, next to the database by default
+BLOB_DIR = pathlib.Path(
+    os.environ.get("XPENSE_BLOB_DIR", pathlib.Path(app.__file__).parent.parent / "prisma" / "blobs"),
+)
+
+
+# Blobs are readable by every user, as the server may run as another user than the seeding script
+BLOB_MODE = 0o644
+
+
+class BlobStore:
+    """A directory of immutable files, named by the SHA-256 hash of their content
+
+    Storing the same content twice stores a single file, and a file never
+    changes once written, so it can be served directly from disk.
+    """
+
+    def __init__(self, root: pathlib.Path) -> None:
+        """Create a store in `root`, which is created on the first write"""
+        self.root = root
+
+    def path(self, content_hash: str) -> pathlib.Path:
+        """Get the path of a blob, which is sharded by the first two characters of its hash"""
+        return self.root / content_hash[:2] / content_hash
+
+    def exists(self, content_hash: str) -> bool:
+        """Check if a blob is stored"""
+        return self.path(content_hash).is_file()
+
+    def put(self, data: bytes) -> str:
+        """Store a blob if it is not stored yet, and return its hash"""
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(content_hash)
+        if path.is_file():
+            return content_hash
+
+        # Write to a temporary file first, so a blob is never seen half written
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+            file.write(data)
+        # A temporary file is only readable by its owner
+        os.chmod(file.name, BLOB_MODE)
+        os.replace(file.name, path)
+
+        return content_hash
+
+
+blob_store = BlobStore(BLOB_DIR)
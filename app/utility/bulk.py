@@ -0,0 +1,127 @@
+"""Bulk utilities, which stream rows from seed files and insert them in batches"""
+import datetime
+import itertools
+import json
+import os
+import pathlib
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from typing import Any
+
+from prisma import Prisma
+
+# Rows inserted by a single batch, which is sent to the query engine as one request
+BULK_BATCH_SIZE = int(os.environ.get("XPENSE_BULK_BATCH_SIZE", "1000"))
+
+# A table is loaded in a single transaction, which may take much longer than the
+# default transaction timeout of Prisma
+BULK_TX_TIMEOUT = datetime.timedelta(hours=1)
+
+Row = dict[str, Any]
+
+
+def iter_json_rows(path: pathlib.Path, read_size: int = 1 << 16) -> Iterator[Row]:  # noqa: C901
+    """Iterate over the rows of a JSON array, or of a newline delimited JSON file
+
+    The file is read in blocks of `read_size` characters, so only the current
+    block and row are held in memory. Files with a .ndjson or .jsonl suffix are
+    read as newline delimited JSON. Every row must be an object.
+    """
+    with path.open(encoding="utf-8") as file:
+        if path.suffix in (".ndjson", ".jsonl"):
+            for line in file:
+                if line.strip():
+                    row = json.loads(line)
+                    if not isinstance(row, dict):
+                        message = f"Invalid row in {path}, rows must be objects"
+                        raise ValueError(message)
+                    yield row
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = ""
+        position = 0
+        eof = False
+        # Either the opening bracket, a row, or the separator after a row is expected
+        expected = "["
+
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+
+            char = buffer[position] if position < len(buffer) else ""
+            if expected == "[" and char == "[":
+                position += 1
+                expected = "first"
+                continue
+            if expected in ("first", ",") and char == "]":
+                return
+            if expected == "," and char == ",":
+                position += 1
+                expected = "row"
+                continue
+
+            if expected in ("first", "row") and char:
+                try:
+                    row, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # Only an object is a row. Unlike a number, which may continue in the
+                    # next block, an object is complete once it decodes.
+                    if not isinstance(row, dict):
+                        message = f"Invalid row in {path} at character {position}, rows must be objects"
+                        raise ValueError(message)  # noqa: TRY004
+                    yield row
+                    position = end
+                    expected = ","
+                    continue
+
+            if eof:
+                message = f"Invalid JSON array in {path} at character {position}"
+                raise ValueError(message)
+
+            # The buffer ends within the next token, so the next block is read
+            block = file.read(read_size)
+            eof = not block
+            buffer = buffer[position:] + block
+            position = 0
+
+
+def chunked(rows: Iterable[Row], size: int) -> Iterator[list[Row]]:
+    """Split rows into lists of at most `size` rows"""
+    iterator = iter(rows)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+async def bulk_create(
+    db: Prisma,
+    model: str,
+    rows: Iterable[Row],
+    prepare: Callable[[list[Row]], Awaitable[list[Row]]] | None = None,
+    batch_size: int = BULK_BATCH_SIZE,
+) -> int:
+    """Insert rows into the table of a model, and return the number of inserted rows
+
+    The rows are inserted in batches of `batch_size` rows within a single
+    transaction, so a table is either loaded completely or not at all. Each
+    batch is passed through `prepare` first, if given.
+
+    Prisma does not support `create_many` on SQLite, so every batch sends its
+    creates to the query engine in a single request instead.
+    """
+    count = 0
+    async with db.tx(timeout=BULK_TX_TIMEOUT) as tx:
+        for chunk in chunked(rows, batch_size):
+            if prepare:
+                chunk = await prepare(chunk)  # noqa: PLW2901
+
+            async with tx.batch_() as batcher:
+                actions = getattr(batcher, model)
+                for row in chunk:
+                    actions.create(data=row)
+
+            count += len(chunk)
+
+    return count
@@ -0,0 +1,87 @@
+"""Cache utilities, which implement bounded in-process caches with hit and miss counters"""
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+# Every cache by name, so their counters can be reported together
+caches: dict[str, "TTLCache"] = {}
+
+
+class CacheStats(BaseModel):
+    """The counters of a cache"""
+
+    name: str
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+
+
+class TTLCache(Generic[K, V]):
+    """A size bounded LRU cache, where every entry expires after a time to live
+
+    The cache is local to the worker process, so entries written by another
+    worker are only seen once the local entry expires or is invalidated.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float) -> None:
+        """Create an empty cache with at most `max_size` entries, registered under `name`"""
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        caches[name] = self
+
+    def get(self, key: K) -> V | None:
+        """Get an entry, or None if it is missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self.invalidate(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: K, value: V, ttl: float | None = None) -> None:
+        """Set an entry, which expires after `ttl` seconds or the default time to live"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self.invalidate(key)
+        if ttl <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: K) -> None:
+        """Remove an entry"""
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        """Get the counters of the cache"""
+        return CacheStats(
+            name=self.name,
+            size=len(self._entries),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+
+def cache_stats() -> list[CacheStats]:
+    """Get the counters of every cache"""
+    return [cache.stats() for cache in caches.values()]
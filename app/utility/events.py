@@ -0,0 +1,210 @@
+"""Event utilities, which publish the changes of a group to its subscribers"""
+import asyncio
+import datetime
+import json
+import os
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+from typing import Any, Literal
+
+from loguru import logger
+from pydantic import BaseModel
+
+from prisma import Prisma
+
+# The broker which delivers the events, "local" only delivers them within the
+# worker process, "sqlite" shares them between workers through an outbox table
+EVENT_BROKER = os.environ.get("XPENSE_EVENT_BROKER", "local")
+
+# Events which may wait for a subscriber, before its buffer is dropped
+SUBSCRIBER_BUFFER_SIZE = 256
+
+OUTBOX_POLL_INTERVAL = 0.5
+OUTBOX_BATCH_SIZE = 1000
+OUTBOX_RETENTION = datetime.timedelta(hours=1)
+OUTBOX_PRUNE_INTERVAL = 60
+
+EventType = Literal["expense_created", "transaction_created", "member_added", "member_removed"]
+
+
+class GroupEvent(BaseModel):
+    """A change to a group, the id is assigned by the broker when it is published"""
+
+    event_id: int = 0
+    event_type: EventType
+    group_id: int
+    data: dict[str, Any]
+
+    def to_sse(self) -> str:
+        """Format the event as a server-sent event"""
+        return f"id: {self.event_id}\nevent: {self.event_type}\ndata: {json.dumps(self.data, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    """The buffer of events of a single subscriber to a group"""
+
+    def __init__(self, group_id: int, max_size: int = SUBSCRIBER_BUFFER_SIZE) -> None:
+        """Create an empty buffer, which holds at most `max_size` events"""
+        self.group_id = group_id
+        self.lagged = False
+        self._queue: asyncio.Queue[GroupEvent] = asyncio.Queue(max_size)
+
+    def push(self, event: GroupEvent) -> None:
+        """Add an event to the buffer, without ever blocking the publisher
+
+        A subscriber which does not keep up loses its buffered events, and is
+        marked as lagged, so it can tell its client to reload the group.
+        """
+        if self._queue.full():
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self.lagged = True
+
+        self._queue.put_nowait(event)
+
+    async def get(self) -> GroupEvent:
+        """Wait for the next event"""
+        return await self._queue.get()
+
+    def take_lagged(self) -> bool:
+        """Check if events were dropped since the last check"""
+        lagged, self.lagged = self.lagged, False
+        return lagged
+
+
+class Broker:
+    """An in-process broker, which delivers the events of a group to its subscribers in this worker"""
+
+    def __init__(self) -> None:
+        """Create a broker without subscribers"""
+        self._subscriptions: defaultdict[int, set[Subscription]] = defaultdict(set)
+        self._last_id = 0
+
+    async def start(self, db: Prisma) -> None:
+        """Start delivering events, the in-process broker needs no setup"""
+
+    async def stop(self) -> None:
+        """Stop delivering events"""
+
+    async def publish(self, event: GroupEvent) -> None:
+        """Publish an event, once the write it describes has been committed"""
+        self._last_id += 1
+        self.deliver(event.model_copy(update={"event_id": self._last_id}))
+
+    def deliver(self, event: GroupEvent) -> None:
+        """Push an event to every subscriber of its group in this worker"""
+        for subscription in self._subscriptions.get(event.group_id, ()):
+            subscription.push(event)
+
+    @asynccontextmanager
+    async def subscribe(self, group_id: int) -> AsyncIterator[Subscription]:
+        """Subscribe to the events of a group, until the context exits"""
+        subscription = Subscription(group_id)
+        self._subscriptions[group_id].add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions[group_id].discard(subscription)
+            if not self._subscriptions[group_id]:
+                del self._subscriptions[group_id]
+
+
+class OutboxBroker(Broker):
+    """A broker which shares events between workers through an outbox table in SQLite
+
+    Publishing inserts the event into the outbox, and every worker polls the
+    outbox for new rows and delivers them to its own subscribers. The ids of
+    the rows are the ids of the events, and rows are deleted once they are
+    older than `OUTBOX_RETENTION`.
+    """
+
+    def __init__(self) -> None:
+        """Create a broker, which polls once it is started"""
+        super().__init__()
+        self._db: Prisma | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self, db: Prisma) -> None:
+        """Start polling the outbox, from the events published after now"""
+        self._db = db
+        last_event = await db.outboxevent.find_first(order={"id": "desc"})
+        self._last_id = last_event.id if last_event else 0
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        """Stop polling the outbox"""
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def publish(self, event: GroupEvent) -> None:
+        """Insert an event into the outbox, from where every worker delivers it"""
+        if not self._db:
+            raise Exception("The event broker is not started")
+
+        await self._db.outboxevent.create(
+            data={"group_id": event.group_id, "type": event.event_type, "data": json.dumps(event.data)},
+        )
+
+    async def _poll(self) -> None:
+        """Deliver new outbox rows, and delete old ones, until cancelled"""
+        assert self._db
+        pruned_at = 0.0
+        while True:
+            rows = []
+            try:
+                rows = await self._db.outboxevent.find_many(
+                    where={"id": {"gt": self._last_id}},
+                    order={"id": "asc"},
+                    take=OUTBOX_BATCH_SIZE,
+                )
+                for row in rows:
+                    self.deliver(
+                        GroupEvent(
+                            event_id=row.id,
+                            event_type=row.type,
+                            group_id=row.group_id,
+                            data=json.loads(row.data),
+                        ),
+                    )
+                    self._last_id = row.id
+
+                # Old rows are deleted now and then, as every delete takes the write lock
+                if time.monotonic() - pruned_at > OUTBOX_PRUNE_INTERVAL:
+                    pruned_at = time.monotonic()
+                    await self._db.outboxevent.delete_many(
+                        where={
+                            "created_at": {"lt": datetime.datetime.now(tz=datetime.UTC) - OUTBOX_RETENTION},
+                        },
+                    )
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to poll the event outbox")
+
+            if len(rows) < OUTBOX_BATCH_SIZE:
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+
+def create_broker() -> Broker:
+    """Create the broker selected by `EVENT_BROKER`"""
+    if EVENT_BROKER == "sqlite":
+        return OutboxBroker()
+    return Broker()
+
+
+broker = create_broker()
+
+
+async def publish_event(event: GroupEvent) -> None:
+    """Publish an event for a write which has been committed
+
+    A failure is logged instead of raised, as the write itself succeeded, and
+    an error response would make the client retry it.
+    """
+    try:
+        await broker.publish(event)
+    except Exception:  # noqa: BLE001
+        logger.exception(f"Failed to publish a {event.event_type} event of group {event.group_id}")
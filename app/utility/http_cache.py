@@ -0,0 +1,17 @@
+"""HTTP caching utilities, which implement entity tags and conditional requests"""
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Check if an If-None-Match header matches an entity tag
+
+    The comparison is weak, as is required for If-None-Match, so a W/ prefix on
+    either tag is ignored.
+    """
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
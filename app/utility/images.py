@@ -0,0 +1,23 @@
+"""Image utilities, which describe the data of an image"""
+import hashlib
+import mimetypes
+
+from pydantic import BaseModel
+
+
+class ImageInfo(BaseModel):
+    """The metadata columns of an image, computed from its data"""
+
+    size: int
+    content_hash: str
+    mime_type: str
+
+
+def describe_image(name: str, data: bytes) -> ImageInfo:
+    """Get the size, SHA-256 hash and mime type of an image, the mime type is guessed from its name"""
+    mime_type, _ = mimetypes.guess_type(name)
+    return ImageInfo(
+        size=len(data),
+        content_hash=hashlib.sha256(data).hexdigest(),
+        mime_type=mime_type or "application/octet-stream",
+    )
@@ -0,0 +1,59 @@
+"""Membership utilities, which authorize access to a group"""
+from typing import Annotated
+
+from fastapi import Depends
+from prisma.models import GroupMember
+from prisma.partials import AuthenticatedUser
+
+from prisma import get_client
+
+from app.utility.cache import TTLCache
+from app.utility.security import get_current_user
+
+# Memberships by (username, group_id). Only existing memberships are cached, and
+# only briefly, as a removal in another worker is not seen until the entry expires.
+membership_cache: TTLCache[tuple[str, int], GroupMember] = TTLCache("memberships", max_size=4096, ttl=10)
+
+
+async def get_group_member(
+    group_id: int,
+    current_user: Annotated[AuthenticatedUser, Depends(get_current_user)],
+) -> GroupMember:
+    """Get the membership of the current user in a group
+
+    FastAPI resolves a dependency once per request, so every handler and nested
+    dependency which needs the membership shares a single lookup.
+    """
+    key = (current_user.username, group_id)
+    group_member = membership_cache.get(key)
+
+    if group_member is None:
+        db = get_client()
+        group_member = await db.groupmember.find_first(
+            where={
+                "username": current_user.username,
+                "group_id": group_id,
+            },
+        )
+
+        if not group_member:
+            raise Exception("You are not a member of this group")
+
+        membership_cache.put(key, group_member)
+
+    return group_member
+
+
+async def get_group_owner(
+    group_member: Annotated[GroupMember, Depends(get_group_member)],
+) -> GroupMember:
+    """Get the membership of the current user in a group, which they must own"""
+    if not group_member.is_owner:
+        raise Exception("You are not the owner of this group")
+
+    return group_member
+
+
+def invalidate_membership(username: str, group_id: int) -> None:
+    """Drop the cached membership of a user, after it has been changed"""
+    membership_cache.invalidate((username, group_id))
@@ -0,0 +1,192 @@
+"""Metrics utilities, which record the latency and database usage of every route
+
+The metrics are local to the worker process, like the caches, so every worker
+reports its own requests.
+"""
+import bisect
+import os
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from loguru import logger
+from prisma.engine._types import TransactionId
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.utility.cache import cache_stats
+from prisma import Prisma
+
+# A request which issues more queries than this is logged, as it is likely an N+1 query
+QUERY_BUDGET = int(os.environ.get("XPENSE_QUERY_BUDGET", "10"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Requests which did not match any route share a single label, so unknown paths
+# cannot create an unbounded number of series
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestStats:
+    """The database usage of a single request"""
+
+    def __init__(self) -> None:
+        """Create empty counters"""
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# The counters of the current request, which the instrumented Prisma engine adds to
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    """A histogram with fixed upper bounds, as exposed by Prometheus"""
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        """Create an empty histogram with the given upper bounds"""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Record a value"""
+        self.sum += value
+        self.count += 1
+        bucket = bisect.bisect_left(self.buckets, value)
+        if bucket < len(self.buckets):
+            self.counts[bucket] += 1
+
+
+class RouteMetrics:
+    """The metrics of a single route"""
+
+    def __init__(self) -> None:
+        """Create empty metrics"""
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+
+
+# The metrics of every route, by method and route template
+routes: dict[tuple[str, str], RouteMetrics] = {}
+
+
+def instrument_prisma(db: Prisma) -> None:
+    """Count and time every query of a connected Prisma client
+
+    Every query, including those of transactions and batches, is sent through
+    the query engine, which is shared by all copies of the client.
+    """
+    engine = db._engine  # noqa: SLF001
+    query = engine.query
+
+    async def timed_query(content: str, *, tx_id: TransactionId | None) -> Any:  # noqa: ANN401
+        """Send a query, and add it to the counters of the current request"""
+        stats = _request_stats.get()
+        if stats is None:
+            return await query(content, tx_id=tx_id)
+
+        start = time.perf_counter()
+        try:
+            return await query(content, tx_id=tx_id)
+        finally:
+            stats.queries += 1
+            stats.db_seconds += time.perf_counter() - start
+
+    engine.query = timed_query  # type: ignore[method-assign]
+
+
+class MetricsMiddleware:
+    """Record the latency and database usage of every request, by route template"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        """Wrap an ASGI app"""
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Handle a request"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_stats.reset(token)
+
+            # The router adds the matched route to the scope
+            route = scope.get("route")
+            template = getattr(route, "path", UNMATCHED_ROUTE)
+
+            metrics = routes.setdefault((scope["method"], template), RouteMetrics())
+            metrics.latency.observe(time.perf_counter() - start)
+            metrics.queries.observe(stats.queries)
+            metrics.db_seconds += stats.db_seconds
+
+            if stats.queries > QUERY_BUDGET:
+                logger.warning(
+                    f"{scope['method']} {scope['path']} issued {stats.queries} queries, "
+                    f"which is over the budget of {QUERY_BUDGET}",
+                )
+
+
+def _labels(**labels: str) -> str:
+    """Format the labels of a sample"""
+    escaped = {
+        name: value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for name, value in labels.items()
+    }
+    return ",".join(f'{name}="{value}"' for name, value in escaped.items())
+
+
+def _histogram_samples(name: str, labels: str, histogram: Histogram) -> list[str]:
+    """Format the cumulative buckets, sum and count of a histogram"""
+    samples = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts, strict=True):
+        cumulative += count
+        samples.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    samples.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    samples.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    samples.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return samples
+
+
+def render_metrics() -> str:
+    """Format every metric in the Prometheus text format"""
+    latency = [
+        "# HELP xpense_request_duration_seconds Latency of requests",
+        "# TYPE xpense_request_duration_seconds histogram",
+    ]
+    queries = [
+        "# HELP xpense_request_queries Prisma queries issued by a request",
+        "# TYPE xpense_request_queries histogram",
+    ]
+    db_seconds = [
+        "# HELP xpense_request_db_seconds_total Time spent waiting for Prisma queries",
+        "# TYPE xpense_request_db_seconds_total counter",
+    ]
+    for (method, template), metrics in sorted(routes.items()):
+        labels = _labels(method=method, route=template)
+        latency += _histogram_samples("xpense_request_duration_seconds", labels, metrics.latency)
+        queries += _histogram_samples("xpense_request_queries", labels, metrics.queries)
+        db_seconds.append(f"xpense_request_db_seconds_total{{{labels}}} {metrics.db_seconds}")
+
+    cache_hits = ["# HELP xpense_cache_hits_total Cache hits", "# TYPE xpense_cache_hits_total counter"]
+    cache_misses = [
+        "# HELP xpense_cache_misses_total Cache misses",
+        "# TYPE xpense_cache_misses_total counter",
+    ]
+    cache_size = ["# HELP xpense_cache_size Size of the cache entries", "# TYPE xpense_cache_size gauge"]
+    for stats in cache_stats():
+        labels = _labels(cache=stats.name)
+        cache_hits.append(f"xpense_cache_hits_total{{{labels}}} {stats.hits}")
+        cache_misses.append(f"xpense_cache_misses_total{{{labels}}} {stats.misses}")
+        cache_size.append(f"xpense_cache_size{{{labels}}} {stats.size}")
+
+    return "\n".join(latency + queries + db_seconds + cache_hits + cache_misses + cache_size) + "\n"
@@ -0,0 +1,121 @@
+"""Pagination utilities, which implement keyset pagination and NDJSON streaming of list endpoints"""
+import base64
+import binascii
+import json
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Annotated, TypeVar
+
+from fastapi import Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.utility.responses import FastJSONResponse
+
+# The cursor of the next page is returned in this header, so the response body
+# of the list endpoints stays a plain list
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+
+Key = tuple[int | str, ...]
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def encode_cursor(key: Key) -> str:
+    """Encode the key of the last row of a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Key:
+    """Decode a cursor created by `encode_cursor`"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise Exception("Invalid cursor") from None
+
+    if not isinstance(key, list) or not all(isinstance(value, int | str) for value in key):
+        raise Exception("Invalid cursor")
+
+    return tuple(key)
+
+
+class Pagination(BaseModel):
+    """The pagination parameters of a list request"""
+
+    limit: int | None
+    after: Key | None
+    stream: bool
+
+
+def get_pagination(
+    limit: Annotated[
+        int | None,
+        Query(ge=1, le=MAX_PAGE_SIZE, description="Maximum number of rows, all rows if not set"),
+    ] = None,
+    after: Annotated[
+        str | None,
+        Query(description=f"Cursor of the previous page, as returned in the {NEXT_CURSOR_HEADER} header"),
+    ] = None,
+    stream: Annotated[
+        bool,
+        Query(description="Stream every row after the cursor as newline delimited JSON"),
+    ] = False,
+) -> Pagination:
+    """Get the pagination parameters of a list request"""
+    return Pagination(
+        limit=limit,
+        after=decode_cursor(after) if after else None,
+        stream=stream,
+    )
+
+
+async def paginate(
+    pagination: Pagination,
+    fetch: Callable[[Key | None, int | None], Awaitable[list[ModelT]]],
+    key: Callable[[ModelT], Key],
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """Get a response with a page of rows, or a stream of every row if requested
+
+    `fetch` returns at most `take` rows ordered by their key, starting after the
+    given key, and `key` returns the key of a row. The rows are serialized
+    without validating them against the response model of the endpoint. Any
+    `headers` are added to the response.
+    """
+    headers = dict(headers or {})
+
+    if pagination.stream:
+        return StreamingResponse(
+            _stream(pagination.after, fetch, key),
+            media_type="application/x-ndjson",
+            headers=headers,
+        )
+
+    if pagination.limit is None:
+        return FastJSONResponse(await fetch(pagination.after, None), headers=headers)
+
+    # Fetch a single extra row, to know if there is a next page
+    rows = await fetch(pagination.after, pagination.limit + 1)
+    if len(rows) > pagination.limit:
+        rows = rows[: pagination.limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(key(rows[-1]))
+
+    return FastJSONResponse(rows, headers=headers)
+
+
+async def _stream(
+    after: Key | None,
+    fetch: Callable[[Key | None, int | None], Awaitable[list[ModelT]]],
+    key: Callable[[ModelT], Key],
+) -> AsyncIterator[bytes]:
+    """Stream the rows in chunks, so only a single chunk is held in memory"""
+    while True:
+        rows = await fetch(after, STREAM_CHUNK_SIZE)
+        for row in rows:
+            yield row.model_dump_json().encode() + b"\n"
+
+        if len(rows) < STREAM_CHUNK_SIZE:
+            return
+
+        after = key(rows[-1])
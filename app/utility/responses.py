@@ -0,0 +1,19 @@
+"""Response utilities, which serialize response bodies without validating them again"""
+from typing import Any
+
+import pydantic_core
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSON response, which is serialized by pydantic-core
+
+    pydantic-core serializes models, dates and plain values directly to JSON
+    bytes in Rust. The models returned by Prisma are already validated, so a
+    handler which returns this response skips the validation and conversion of
+    its response model, and the response model is only used for the schema.
+    """
+
+    def render(self, content: Any) -> bytes:  # noqa: ANN401
+        """Serialize the content to JSON"""
+        return pydantic_core.to_json(content)
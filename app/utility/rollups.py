@@ -0,0 +1,76 @@
+"""Rollup utilities, which maintain the monthly spending of every member of a group"""
+import datetime
+from collections import defaultdict
+from typing import Any
+
+from prisma import Prisma
+
+# The format of the month of a rollup row, which sorts in time order
+MONTH_FORMAT = "%Y-%m"
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+
+def get_month(date: datetime.datetime) -> str:
+    """Get the month of a date in UTC, as it is stored in the rollup rows"""
+    return date.astimezone(datetime.UTC).strftime(MONTH_FORMAT)
+
+
+def _increment_args(
+    group_id: int,
+    month: str,
+    username: str,
+    paid_amount_cents: int,
+    owed_amount_cents: int,
+) -> dict[str, Any]:
+    """Get the upsert arguments which add to the rollup row of a user, creating it if needed"""
+    return {
+        "where": {"group_id_month_username": {"group_id": group_id, "month": month, "username": username}},
+        "data": {
+            "create": {
+                "group_id": group_id,
+                "month": month,
+                "username": username,
+                "paid_amount_cents": paid_amount_cents,
+                "owed_amount_cents": owed_amount_cents,
+            },
+            "update": {
+                "paid_amount_cents": {"increment": paid_amount_cents},
+                "owed_amount_cents": {"increment": owed_amount_cents},
+            },
+        },
+    }
+
+
+def get_spending(
+    payer_username: str,
+    amount_in_cents: int,
+    shares: dict[str, int],
+) -> dict[str, tuple[int, int]]:
+    """Get what every user involved in an expense paid and owes, by username"""
+    spending: defaultdict[str, tuple[int, int]] = defaultdict(lambda: (0, 0))
+    spending[payer_username] = (amount_in_cents, 0)
+    for username, share in shares.items():
+        paid, owed = spending[username]
+        spending[username] = (paid, owed + share)
+    return dict(spending)
+
+
+async def record_expense_rollup(  # noqa: PLR0913
+    db: Prisma,
+    group_id: int,
+    date: datetime.datetime,
+    payer_username: str,
+    amount_in_cents: int,
+    shares: dict[str, int],
+) -> None:
+    """Update the monthly rollup for a new expense
+
+    This should be called with a transaction client, so the rollup is updated
+    atomically with the expense itself.
+    """
+    month = get_month(date)
+
+    # All rows are upserted in a single batch, so a wide split costs one round trip
+    async with db.batch_() as batcher:
+        for username, (paid, owed) in get_spending(payer_username, amount_in_cents, shares).items():
+            batcher.monthlyspending.upsert(**_increment_args(group_id, month, username, paid, owed))
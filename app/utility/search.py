@@ -0,0 +1,108 @@
+"""Search utilities, which maintain and query a full-text index of the expenses
+
+The index is a SQLite FTS5 table, which Prisma cannot declare, so it is
+created with raw SQL when the client connects. Triggers on the Expense table
+keep it in sync with every write, however the expense is inserted.
+"""
+import re
+
+from app.utility.bulk import BULK_TX_TIMEOUT
+from prisma import Prisma
+
+# The rowid of an indexed expense is its group id in the high 32 bits and its id
+# in the low 32 bits, so the expenses of a group are a single range of rowids,
+# which FTS5 seeks to instead of filtering every match
+GROUP_SHIFT = 32
+EXPENSE_MASK = (1 << GROUP_SHIFT) - 1
+
+SEARCH_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS ExpenseSearch USING fts5(
+        name,
+        description,
+        prefix = '2 3',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ExpenseSearch_insert AFTER INSERT ON Expense BEGIN
+        INSERT INTO ExpenseSearch (rowid, name, description)
+        VALUES ((new.group_id << 32) | new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ExpenseSearch_delete AFTER DELETE ON Expense BEGIN
+        DELETE FROM ExpenseSearch WHERE rowid = (old.group_id << 32) | old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ExpenseSearch_update AFTER UPDATE OF name, description ON Expense BEGIN
+        DELETE FROM ExpenseSearch WHERE rowid = (old.group_id << 32) | old.id;
+        INSERT INTO ExpenseSearch (rowid, name, description)
+        VALUES ((new.group_id << 32) | new.id, new.name, new.description);
+    END
+    """,
+]
+
+
+async def create_search_index(db: Prisma) -> None:
+    """Create the search index and its triggers, if they do not exist yet"""
+    for statement in SEARCH_SCHEMA:
+        await db.execute_raw(statement)
+
+
+async def rebuild_search_index(db: Prisma) -> int:
+    """Recreate the search index from the expenses, and return the number of indexed expenses
+
+    This is needed for expenses which were inserted before the index existed.
+    """
+    async with db.tx(timeout=BULK_TX_TIMEOUT) as tx:
+        await tx.execute_raw("DELETE FROM ExpenseSearch")
+        count = await tx.execute_raw(
+            "INSERT INTO ExpenseSearch (rowid, name, description) "
+            "SELECT (group_id << 32) | id, name, description FROM Expense",
+        )
+
+    # Merge the segments of the index, which keeps lookups fast
+    await db.execute_raw("INSERT INTO ExpenseSearch (ExpenseSearch) VALUES ('optimize')")
+
+    return count
+
+
+def build_match_query(query: str) -> str | None:
+    """Build the FTS5 query which matches every word of a search query
+
+    The words are quoted, so the search query can never use the FTS5 query
+    syntax, and the last word is matched as a prefix, so results show up while
+    typing. Returns None if the search query has no words.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+async def search_expense_ids(
+    db: Prisma,
+    group_id: int,
+    query: str,
+    offset: int,
+    limit: int | None,
+) -> list[int]:
+    """Get the ids of the expenses of a group which match a search query, best match first"""
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    # The rank of FTS5 is BM25, where a lower value is a better match
+    rows = await db.query_raw(
+        "SELECT rowid FROM ExpenseSearch WHERE ExpenseSearch MATCH ? AND rowid BETWEEN ? AND ? "
+        "ORDER BY rank, rowid LIMIT ? OFFSET ?",
+        match,
+        group_id << GROUP_SHIFT,
+        group_id << GROUP_SHIFT | EXPENSE_MASK,
+        -1 if limit is None else limit,
+        offset,
+    )
+    return [int(row["rowid"]) & EXPENSE_MASK for row in rows]
@@ -1,18 +1,41 @@
 """Security utilities"""
+import asyncio
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Annotated
+from typing import Annotated, TypeVar
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from prisma.models import TokenData, User
+from prisma.partials import AuthenticatedUser
 
 from prisma import get_client
 
+from app.utility.cache import TTLCache
+
+T = TypeVar("T")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# The bcrypt cost factor. Stored hashes with another cost are rehashed on login.
+BCRYPT_ROUNDS = int(os.environ.get("XPENSE_BCRYPT_ROUNDS", "12"))
+# The number of processes which hash passwords, and how many requests may wait for one
+PASSWORD_WORKERS = int(os.environ.get("XPENSE_PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_QUEUE_SIZE = int(os.environ.get("XPENSE_PASSWORD_QUEUE_SIZE", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -20,19 +43,88 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bool(pwd_context.verify(plain_password, hashed_password))
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verify the password, and return a new hash if the stored one needs an update"""
+    verified, new_hash = pwd_context.verify_and_update(plain_password, hashed_password)
+    return bool(verified), new_hash
+
+
 def get_password_hash(password: str) -> str:
     """Get the password hash"""
     return str(pwd_context.hash(password))
 
 
-def authenticate_user(username: str, password: str) -> User | None:
+class PasswordPool:
+    """A process pool for password hashing and verification
+
+    bcrypt takes tens of milliseconds of CPU per call, with the GIL held, so it
+    runs in dedicated processes instead of on the event loop. At most `workers`
+    calls run at once and `queue_size` more may wait; any further request is
+    rejected with a 503, so a login burst cannot pile up unbounded work.
+    """
+
+    def __init__(self, workers: int, queue_size: int) -> None:
+        """Create the pool, the processes are started on first use"""
+        self.workers = workers
+        self.limit = workers + queue_size
+        self.pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Get the process pool, starting it if needed"""
+        if self._executor is None:
+            # Spawned processes do not inherit the event loop or the Prisma engine
+            self._executor = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def run(self, fn: Callable[..., T], *args: str) -> T:
+        """Run a password function in the pool, or raise a 503 if the pool is full"""
+        if self.pending >= self.limit:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password requests",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        """Hash many passwords in parallel, without the queue bound, for bulk jobs such as seeding"""
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            *(loop.run_in_executor(self.executor, get_password_hash, password) for password in passwords),
+        )
+
+    def shutdown(self) -> None:
+        """Stop the processes of the pool"""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+password_pool = PasswordPool(PASSWORD_WORKERS, PASSWORD_QUEUE_SIZE)
+
+
+async def authenticate_user(username: str, password: str) -> User | None:
     """Authenticate the user"""
     db = get_client()
-    user = db.user.find_first(where={"username": username})
+    user = await db.user.find_first(where={"username": username})
     if user is None:
         return None
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await password_pool.run(verify_and_update_password, password, user.hashed_password)
+    if not verified:
         return None
+    if new_hash:
+        # The stored hash uses an outdated scheme or cost factor
+        user = await db.user.update(where={"username": username}, data={"hashed_password": new_hash})
     return user
 
 
@@ -56,23 +148,37 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> User:
+# Resolved users by username, and verified token subjects by token
+user_cache: TTLCache[str, AuthenticatedUser] = TTLCache("users", max_size=1024, ttl=60)
+token_cache: TTLCache[str, str] = TTLCache("tokens", max_size=4096, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> AuthenticatedUser:
     """Get the current user"""
-    db = get_client()
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception from None
-    user = db.user.find_first(where={"username": token_data.username})
+
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except JWTError:
+            raise credentials_exception from None
+        # The verified token is only cached until it expires
+        token_cache.put(token, token_data.username, ttl=payload["exp"] - time.time())
+
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        user = await AuthenticatedUser.prisma().find_first(where={"username": username})
+        if user is None:
+            raise credentials_exception
+        user_cache.put(username, user)
+
     return user
@@ -0,0 +1,35 @@
+"""Sequence utilities, which allocate the per-group ids of expenses and transactions"""
+from prisma import Prisma
+
+
+async def allocate_expense_id(db: Prisma, group_id: int) -> int:
+    """Allocate the next expense id of a group
+
+    The counter is incremented with a single UPDATE, which holds the database
+    write lock until the surrounding transaction commits. Concurrent writers,
+    including other worker processes, can therefore never receive the same id.
+    The same UPDATE bumps the version of the group, as an id is only allocated
+    for a write to the group.
+    """
+    group = await db.group.update(
+        where={"id": group_id},
+        data={"next_expense_id": {"increment": 1}, "version": {"increment": 1}},
+    )
+
+    if not group:
+        raise Exception("Group not found")
+
+    return group.next_expense_id - 1
+
+
+async def allocate_transaction_id(db: Prisma, group_id: int) -> int:
+    """Allocate the next transaction id of a group, see `allocate_expense_id`"""
+    group = await db.group.update(
+        where={"id": group_id},
+        data={"next_transaction_id": {"increment": 1}, "version": {"increment": 1}},
+    )
+
+    if not group:
+        raise Exception("Group not found")
+
+    return group.next_transaction_id - 1
@@ -1,10 +1,59 @@
 """This is a helper library, which seeds the database with some data"""
-import json
+import argparse
+import asyncio
 import pathlib
 import subprocess
+import sys
+import urllib.parse
+from collections import defaultdict
+from collections.abc import Iterator
+
+from loguru import logger
+
 import app
 from app.utility import security
-from prisma import Prisma, get_client, register, Base64
+from app.utility.balances import MemberTotals, get_ledger, get_member_totals
+from app.utility.blobs import blob_store
+from app.utility.bulk import BULK_BATCH_SIZE, BULK_TX_TIMEOUT, Row, bulk_create, chunked, iter_json_rows
+from app.utility.images import describe_image
+from app.utility.rollups import get_month, get_spending
+from app.utility.search import create_search_index, rebuild_search_index
+from app.utility.versions import bump_group_version
+from prisma import Prisma, get_client, register
+from prisma.partials import ImageMetadata
+
+# The seed files by name, and the model of their table, in the order they are loaded
+SEED_TABLES = [
+    ("users", "user"),
+    ("currencies", "currency"),
+    ("groups", "group"),
+    ("group_members", "groupmember"),
+    ("expenses", "expense"),
+    ("expense_members", "expensemember"),
+    ("transactions", "transaction"),
+]
+
+# The database of the schema, whose url is relative to the schema
+DATABASE_PATH = (pathlib.Path(app.__file__).parent.parent / "prisma" / "database.db").resolve()
+
+# The query engine applies the socket timeout to every connection of its pool, as
+# the busy timeout in seconds, so a writer waits this long for another writer
+# instead of failing
+SQLITE_URL_PARAMS = {"socket_timeout": 5}
+
+# The SQLite performance profile. The journal mode is stored in the database file,
+# the other settings are best-effort, as they only apply to the connection which runs them
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # With WAL, a commit only waits for the log, and is still safe against application crashes
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    # In KiB when negative
+    "cache_size": -64 * 1024,
+}
+
+# The files which SQLite keeps next to a database
+SQLITE_SUFFIXES = ("-journal", "-wal", "-shm")
 
 
 def clamp(n: int, minn: int, maxn: int) -> int:
@@ -14,66 +63,323 @@ def clamp(n: int, minn: int, maxn: int) -> int:
 
 def delete_db() -> None:
     """Delete the database"""
-    database_dir = (pathlib.Path(app.__file__).parent.parent / "prisma" / "database.db").resolve()
-    subprocess.run(["rm", "-f", database_dir], check=True)  # noqa: S603, S607
+    for path in [
+        DATABASE_PATH,
+        *(DATABASE_PATH.with_name(DATABASE_PATH.name + suffix) for suffix in SQLITE_SUFFIXES),
+    ]:
+        path.unlink(missing_ok=True)
     subprocess.run(["prisma", "db", "push"], check=True)  # noqa: S603, S607
 
 
-def register_prisma() -> None:
-    """Register the Prisma client"""
-    db = Prisma()
-    db.connect()
+async def register_prisma(datasource_url: str | None = None) -> Prisma:
+    """Connect and register the Prisma client, to the database of the schema unless another is given"""
+    url = datasource_url or f"file:{DATABASE_PATH}"
+    separator = "&" if "?" in url else "?"
+    db = Prisma(datasource={"url": f"{url}{separator}{urllib.parse.urlencode(SQLITE_URL_PARAMS)}"})
+    await db.connect()
     register(db)
+    await apply_sqlite_pragmas(db)
+    await create_search_index(db)
+    return db
+
+
+async def apply_sqlite_pragmas(db: Prisma) -> None:
+    """Apply the SQLite performance profile to a connected client
+
+    The WAL journal mode is stored in the database file, so readers no longer
+    block on writers from then on, on every connection. The other settings are
+    best-effort, as they only apply to the pooled connection which executes
+    them, while the other connections keep the defaults of SQLite.
+    """
+    # Some pragmas return their new value, which only a raw query accepts
+    for pragma, value in SQLITE_PRAGMAS.items():
+        await db.query_raw(f"PRAGMA {pragma} = {value}")
+
+
+def find_seed_file(seeds_dir: pathlib.Path, name: str) -> pathlib.Path | None:
+    """Find the seed file of a table, which is either newline delimited JSON or a JSON array"""
+    for suffix in (".ndjson", ".jsonl", ".json"):
+        path = seeds_dir / f"{name}{suffix}"
+        if path.is_file():
+            return path
+    return None
+
+
+async def hash_passwords(users: list[Row]) -> list[Row]:
+    """Replace the password of every user by its hash, which are computed in parallel"""
+    hashed_passwords = await security.password_pool.hash_many([user.pop("password") for user in users])
+    for user, hashed_password in zip(users, hashed_passwords, strict=True):
+        user["hashed_password"] = hashed_password
+    return users
 
 
-def seed_db() -> None:  # noqa: C901
-    """Seeds the database with some data"""
+async def seed_db(seeds_dir: pathlib.Path | None = None) -> None:
+    """Seeds the database with the data in a seeds directory, the seeds of the repository by default
+
+    Every table is streamed from its seed file and inserted in batches, so seed
+    files of any size can be loaded. A table without a seed file is left empty.
+    """
     db = get_client()
 
     # Seeds dir
-    seeds_dir = pathlib.Path(app.__file__).parent.parent / "seeds"
+    seeds_dir = seeds_dir or pathlib.Path(app.__file__).parent.parent / "seeds"
 
     # Setup images
-    # iterate over all images in the images directory
-    images_dir = seeds_dir / "images"
-    for image in images_dir.iterdir():
-        db.image.create(data={"name": image.name, "data": Base64.encode(image.read_bytes())})
-
-    # Setup users
-    users = json.loads((seeds_dir / "users.json").read_text())
-    users_db = []
-    for user in users:
-        user["hashed_password"] = security.get_password_hash(user["password"])
-        del user["password"]
-        users_db.append(db.user.create(data=user))
-
-    # Setup currencies
-    currencies = json.loads((seeds_dir / "currencies.json").read_text())
-    for currency in currencies:
-        db.currency.create(data=currency)
-
-    # Setup groups
-    groups = json.loads((seeds_dir / "groups.json").read_text())
-    for group in groups:
-        db.group.create(data=group)
-
-    # Setup group members
-    group_members = json.loads((seeds_dir / "group_members.json").read_text())
-    for group_member in group_members:
-        db.groupmember.create(data=group_member)
-
-    # Setup expenses
-    expenses = json.loads((seeds_dir / "expenses.json").read_text())
-    for expense in expenses:
-        db.expense.create(data=expense)
-
-    # Setup expense members
-    expense_members = json.loads((seeds_dir / "expense_members.json").read_text())
-    for expense_member in expense_members:
-        db.expensemember.create(data=expense_member)
+    # iterate over all images in the images directory, and store their data in the blob store
+    def images() -> Iterator[Row]:
+        for image in (seeds_dir / "images").iterdir():
+            image_data = image.read_bytes()
+            blob_store.put(image_data)
+            yield {"name": image.name, **describe_image(image.name, image_data).model_dump()}
+
+    logger.info(f"Seeded {await bulk_create(db, 'image', images())} image(s)")
+
+    # Setup the tables, in the order of their relations
+    for name, model in SEED_TABLES:
+        path = find_seed_file(seeds_dir, name)
+        if not path:
+            continue
+
+        count = await bulk_create(
+            db,
+            model,
+            iter_json_rows(path),
+            prepare=hash_passwords if model == "user" else None,
+        )
+        logger.info(f"Seeded {count} row(s) from {path.name}")
+
+    # Setup the id sequences, the balance ledger and the monthly rollups
+    await sync_sequences()
+    await rebuild_ledger()
+    await rebuild_rollups()
+
+
+async def sync_sequences() -> None:
+    """Move the id sequence of every group past its existing expenses and transactions
+
+    This is needed after rows have been inserted with explicit ids, such as
+    when seeding, or when the sequence columns are added to an existing database.
+    """
+    db = get_client()
+
+    # A single statement reads and moves every sequence, so an id allocated by the
+    # server in the meantime can never be handed out again
+    await db.execute_raw(
+        """
+        UPDATE "Group" SET
+            next_expense_id = MAX(
+                next_expense_id,
+                COALESCE((SELECT MAX(id) FROM Expense WHERE group_id = "Group".id), 0) + 1
+            ),
+            next_transaction_id = MAX(
+                next_transaction_id,
+                COALESCE((SELECT MAX(id) FROM "Transaction" WHERE group_id = "Group".id), 0) + 1
+            )
+        """,
+    )
+
+
+async def migrate_images() -> int:
+    """Move the data of every image out of the database and into the blob store
+
+    The blob store is content addressed, so images with identical data share a
+    single file. The metadata of each image is computed along the way. Returns
+    the number of migrated images.
+    """
+    db = get_client()
+    migrated = 0
+
+    # Only the metadata is listed, so a single image is held in memory at a time
+    for metadata in await ImageMetadata.prisma().find_many(where={"NOT": [{"data": None}]}):
+        image = await db.image.find_unique(where={"name": metadata.name})
+        if not image or image.data is None:
+            continue
+
+        image_data = image.data.decode()
+        blob_store.put(image_data)
+        await db.image.update(
+            where={"name": image.name},
+            data={"data": None, **describe_image(image.name, image_data).model_dump()},
+        )
+        migrated += 1
+
+    # Give the space of the moved data back to the file system
+    if migrated:
+        await db.execute_raw("VACUUM")
+
+    return migrated
+
+
+async def rebuild_rollups() -> int:
+    """Recompute the monthly rollups of every group from the expenses, and return the number of rows
+
+    The rollups of a group are replaced in a single transaction, which reads
+    the expenses of the group in batches. It first bumps the version of the
+    group, which takes the write lock, so the server may keep running without
+    an expense being written between the reads and the replacement.
+    """
+    db = get_client()
+    count = 0
+
+    for group in await db.group.find_many():
+        async with db.tx(timeout=BULK_TX_TIMEOUT) as tx:
+            await bump_group_version(tx, group.id)
+
+            spending: defaultdict[tuple[str, str], tuple[int, int]] = defaultdict(lambda: (0, 0))
+            after = 0
+            while expenses := await tx.expense.find_many(
+                where={"group_id": group.id, "id": {"gt": after}},
+                include={"ExpenseMember": True},
+                order={"id": "asc"},
+                take=BULK_BATCH_SIZE,
+            ):
+                for expense in expenses:
+                    month = get_month(expense.date)
+                    shares = {
+                        member.username: member.amount_in_cents for member in expense.ExpenseMember or []
+                    }
+                    expense_spending = get_spending(expense.payer_username, expense.amount_in_cents, shares)
+                    for username, (paid, owed) in expense_spending.items():
+                        total_paid, total_owed = spending[(month, username)]
+                        spending[(month, username)] = (total_paid + paid, total_owed + owed)
+                after = expenses[-1].id
+
+            await tx.monthlyspending.delete_many(where={"group_id": group.id})
+            for chunk in chunked(
+                (
+                    {
+                        "group_id": group.id,
+                        "month": month,
+                        "username": username,
+                        "paid_amount_cents": paid,
+                        "owed_amount_cents": owed,
+                    }
+                    for (month, username), (paid, owed) in spending.items()
+                ),
+                BULK_BATCH_SIZE,
+            ):
+                async with tx.batch_() as batcher:
+                    for row in chunk:
+                        batcher.monthlyspending.create(data=row)
+
+        count += len(spending)
+
+    return count
+
+
+async def rebuild_ledger(verify_only: bool = False) -> int:
+    """Recompute the balance ledger from the raw rows, and report any drift
+
+    Returns the number of ledger rows which did not match the raw rows. Unless
+    `verify_only` is set, those rows are overwritten with the recomputed values.
+
+    Every group is checked in its own transaction, so the server may keep
+    running. A verification reads a single snapshot of the group, and a rebuild
+    first bumps the version of the group, which takes the write lock, so no
+    expense or transaction can be written between the reads and the repairs.
+    """
+    db = get_client()
+    drift = 0
+
+    for group in await db.group.find_many():
+        async with db.tx(timeout=BULK_TX_TIMEOUT) as tx:
+            if not verify_only:
+                await bump_group_version(tx, group.id)
+
+            totals = await get_member_totals(tx, group.id)
+            ledger = await get_ledger(tx, group.id)
+
+            for username in totals.keys() | ledger.keys():
+                expected = totals.get(username, MemberTotals())
+                actual = ledger.get(username)
+                actual_balance = actual.balance_amount_cents if actual else 0
+                actual_transferred = actual.transferred_amount_cents if actual else 0
+
+                if (actual_balance, actual_transferred) == (
+                    expected.balance_amount_cents,
+                    expected.transferred_amount_cents,
+                ):
+                    continue
+
+                drift += 1
+                logger.warning(
+                    f"Ledger drift in group {group.id} for {username}: "
+                    f"balance {actual_balance} != {expected.balance_amount_cents}, "
+                    f"transferred {actual_transferred} != {expected.transferred_amount_cents}",
+                )
+
+                if verify_only:
+                    continue
+
+                values = {
+                    "balance_amount_cents": expected.balance_amount_cents,
+                    "transferred_amount_cents": expected.transferred_amount_cents,
+                }
+                await tx.memberbalance.upsert(
+                    where={"group_id_username": {"group_id": group.id, "username": username}},
+                    data={
+                        "create": {"group_id": group.id, "username": username, **values},
+                        "update": values,
+                    },
+                )
+
+    return drift
 
 
 if __name__ == "__main__":
-    delete_db()
-    register_prisma()
-    seed_db()
+    parser = argparse.ArgumentParser(description="Manage the XPense database")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="seed",
+        choices=[
+            "seed",
+            "sync-sequences",
+            "migrate-images",
+            "verify-ledger",
+            "rebuild-ledger",
+            "rebuild-rollups",
+            "rebuild-search",
+        ],
+        help="seed: recreate and seed the database (default), "
+        "sync-sequences: move the per-group id sequences past the existing rows, "
+        "migrate-images: move the image data out of the database and into the blob store, "
+        "verify-ledger: report balance ledger drift, "
+        "rebuild-ledger: recompute the balance ledger from the raw rows, "
+        "rebuild-rollups: recompute the monthly spending rollups from the expenses, "
+        "rebuild-search: recreate the full-text search index of the expenses",
+    )
+    parser.add_argument(
+        "--seeds-dir",
+        type=pathlib.Path,
+        help="seed from the JSON or NDJSON files in this directory, instead of the seeds of the repository",
+    )
+    args = parser.parse_args()
+
+    async def main() -> int:
+        """Run the selected command"""
+        if args.command == "seed":
+            delete_db()
+            await register_prisma()
+            await seed_db(args.seeds_dir)
+            security.password_pool.shutdown()
+        elif args.command == "sync-sequences":
+            await register_prisma()
+            await sync_sequences()
+        elif args.command == "rebuild-rollups":
+            await register_prisma()
+            logger.info(f"Rebuilt {await rebuild_rollups()} rollup row(s)")
+        elif args.command == "rebuild-search":
+            db = await register_prisma()
+            logger.info(f"Indexed {await rebuild_search_index(db)} expense(s)")
+        elif args.command == "migrate-images":
+            await register_prisma()
+            logger.info(f"Moved {await migrate_images()} image(s) to the blob store")
+        else:
+            await register_prisma()
+            drift = await rebuild_ledger(verify_only=args.command == "verify-ledger")
+            logger.info(f"Found {drift} drifted ledger row(s)")
+            return 1 if drift and args.command == "verify-ledger" else 0
+        return 0
+
+    sys.exit(asyncio.run(main()))
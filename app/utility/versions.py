@@ -0,0 +1,80 @@
+"""Version utilities, which track the changes of a group and answer conditional requests for it"""
+from typing import Annotated
+
+from fastapi import Depends, Header, HTTPException, Response, status
+from prisma.models import GroupMember
+from pydantic import BaseModel
+
+from prisma import Prisma, get_client
+
+from app.utility.http_cache import etag_matches
+from app.utility.membership import get_group_member
+
+# Responses of a group are private to its members, and must be revalidated before they are reused
+GROUP_CACHE_CONTROL = "private, no-cache"
+
+
+class GroupVersion(BaseModel):
+    """The version of a group, which increases with every change to the group"""
+
+    group_id: int
+    version: int
+
+    @property
+    def etag(self) -> str:
+        """The entity tag of every response of the group at this version
+
+        The tag is weak, as the responses of an endpoint at the same version
+        are only equivalent, not byte for byte identical.
+        """
+        return f'W/"{self.group_id}-{self.version}"'
+
+    @property
+    def headers(self) -> dict[str, str]:
+        """The headers which let a client revalidate a response of the group"""
+        return {"ETag": self.etag, "Cache-Control": GROUP_CACHE_CONTROL}
+
+
+async def bump_group_version(db: Prisma, group_id: int) -> int:
+    """Increment the version of a group, and return the new version
+
+    This should be called with a transaction client, so the version changes
+    atomically with the rows it covers. The id sequences in
+    app/utility/sequences.py bump the version themselves.
+    """
+    group = await db.group.update(
+        where={"id": group_id},
+        data={"version": {"increment": 1}},
+    )
+
+    if not group:
+        raise Exception("Group not found")
+
+    return group.version
+
+
+async def get_group_version(
+    group_id: int,
+    response: Response,
+    _: Annotated[GroupMember, Depends(get_group_member)],
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> GroupVersion:
+    """Get the version of a group, and answer with 304 Not Modified if the client is up to date
+
+    The membership is checked first, so the version of a group is never
+    revealed to non-members. The headers are set on the response of handlers
+    which return a model, while handlers which return a response must pass
+    `GroupVersion.headers` to it.
+    """
+    db = get_client()
+
+    group = await db.group.find_unique(where={"id": group_id})
+    if not group:
+        raise Exception("Group not found")
+
+    group_version = GroupVersion(group_id=group_id, version=group.version)
+    if etag_matches(if_none_match, group_version.etag):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=group_version.headers)
+
+    response.headers.update(group_version.headers)
+    return group_version
@@ -0,0 +1 @@
+"""Benchmarks of the API, which run against a synthetic database"""
@@ -0,0 +1,108 @@
+"""This is a helper library, which generates synthetic seeds of any size"""
+import json
+import pathlib
+import random
+import shutil
+
+from pydantic import BaseModel
+
+import app
+
+# Every synthetic user has this password
+PASSWORD = "benchmark"  # noqa: S105
+
+# The user which owns every group, and which the benchmark authenticates as
+BENCHMARK_USERNAME = "user0"
+
+
+class Scale(BaseModel):
+    """The size of a synthetic database"""
+
+    groups: int
+    members: int
+    expenses: int
+    split: int
+
+
+def generate_seeds(seeds_dir: pathlib.Path, scale: Scale, seed: int = 0) -> None:
+    """Write synthetic seeds to a directory, in the format read by `seed_db`
+
+    There are four times as many users as members of a single group, and each
+    group has `BENCHMARK_USERNAME` as its owner and other members drawn from
+    them. Each expense is paid by one member and split between `split` of them.
+    The same `seed` always generates the same seeds.
+    """
+    rng = random.Random(seed)
+    repository_seeds_dir = pathlib.Path(app.__file__).parent.parent / "seeds"
+
+    seeds_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copy(repository_seeds_dir / "currencies.json", seeds_dir / "currencies.json")
+
+    # Every user shares a single profile image
+    images_dir = seeds_dir / "images"
+    images_dir.mkdir(exist_ok=True)
+    shutil.copy(repository_seeds_dir / "images" / "admin.png", images_dir / "user.png")
+
+    usernames = [f"user{i}" for i in range(max(scale.members * 4, 1))]
+    users = [
+        {
+            "username": username,
+            "full_name": f"User {username.removeprefix('user')}",
+            "email": f"{username}@example.com",
+            "password": PASSWORD,
+            "profile_image_name": "user.png",
+        }
+        for username in usernames
+    ]
+
+    groups = []
+    group_members = []
+    expenses = []
+    expense_members = []
+    for group_id in range(1, scale.groups + 1):
+        groups.append(
+            {
+                "id": group_id,
+                "name": f"Group {group_id}",
+                "description": f"Synthetic group {group_id}",
+                "currency_code": "USD",
+            },
+        )
+
+        members = [BENCHMARK_USERNAME, *rng.sample(usernames[1:], min(scale.members, len(usernames)) - 1)]
+        group_members += [
+            {"group_id": group_id, "username": username, "is_owner": username == BENCHMARK_USERNAME}
+            for username in members
+        ]
+
+        for expense_id in range(1, scale.expenses + 1):
+            split = rng.sample(members, min(scale.split, len(members)))
+            shares = [rng.randint(1, 10_000) for _ in split]
+            expenses.append(
+                {
+                    "id": expense_id,
+                    "name": f"Expense {expense_id}",
+                    "description": f"Synthetic expense {expense_id}",
+                    "amount_in_cents": sum(shares),
+                    "group_id": group_id,
+                    "payer_username": rng.choice(members),
+                },
+            )
+            expense_members += [
+                {
+                    "expense_id": expense_id,
+                    "username": username,
+                    "amount_in_cents": share,
+                    "group_id": group_id,
+                }
+                for username, share in zip(split, shares, strict=True)
+            ]
+
+    for name, rows in [
+        ("users", users),
+        ("groups", groups),
+        ("group_members", group_members),
+        ("expenses", expenses),
+        ("expense_members", expense_members),
+    ]:
+        (seeds_dir / f"{name}.json").write_text(json.dumps(rows))
@@ -0,0 +1,453 @@
+"""Benchmark every endpoint of the API in-process, against a synthetic SQLite database
+
+Run it from the root of the repository, and compare the JSON results between commits:
+
+    python3 -m benchmarks.run --groups 10 --members 20 --expenses 1000 --split 5 --output results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from typing import Any
+
+import httpx
+from pydantic import BaseModel
+
+import app
+from benchmarks.generate import BENCHMARK_USERNAME, PASSWORD, Scale, generate_seeds
+
+# The amount of every benchmarked deposit
+DEPOSIT_AMOUNT = 100
+
+
+class Endpoint(BaseModel):
+    """An endpoint to benchmark, and the request which is sent to it
+
+    A `{n}` in a string parameter or form field is replaced by the number of the
+    request, so every request can, for example, sign up another user.
+    """
+
+    name: str
+    method: str
+    route: str
+    path_params: dict[str, int | str] = {}
+    params: dict[str, int | str] = {}
+    form: dict[str, str] | None = None
+    body: dict[str, Any] | None = None
+
+
+def number_values(values: dict[str, Any], n: int) -> dict[str, Any]:
+    """Replace `{n}` by the number of a request, in every string value"""
+    return {key: value.format(n=n) if isinstance(value, str) else value for key, value in values.items()}
+
+
+class EndpointResult(BaseModel):
+    """The latency and database usage of an endpoint"""
+
+    name: str
+    method: str
+    route: str
+    requests: int
+    errors: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    queries_per_request: float
+    db_ms_per_request: float
+
+
+class BenchmarkResult(BaseModel):
+    """The results of a benchmark run"""
+
+    commit: str | None
+    created_at: datetime.datetime
+    scale: Scale
+    seed: int
+    requests: int
+    endpoints: list[EndpointResult]
+
+
+def get_endpoints(scale: Scale, members: list[str]) -> list[Endpoint]:
+    """Get the endpoints to benchmark, with requests against the first group of the synthetic seeds
+
+    The users signed up by `signup` are then added to, and removed from, the
+    first group, so those endpoints are benchmarked in this order.
+    """
+    group = {"group_id": 1}
+    expense = {"group_id": 1, "expense_id": 1}
+    split = members[: scale.split]
+    signup_username = "signup{n}"
+
+    return [
+        Endpoint(
+            name="login",
+            method="POST",
+            route="/token",
+            form={"username": BENCHMARK_USERNAME, "password": PASSWORD},
+        ),
+        Endpoint(
+            name="signup",
+            method="POST",
+            route="/signup",
+            form={
+                "username": signup_username,
+                "email": "signup{n}@example.com",
+                "full_name": "Signup {n}",
+                "password": PASSWORD,
+                "profile_image": "user.png",
+            },
+        ),
+        Endpoint(
+            name="update_user",
+            method="PUT",
+            route="/users/{username}",
+            path_params={"username": BENCHMARK_USERNAME},
+            form={
+                "email": f"{BENCHMARK_USERNAME}@example.com",
+                "full_name": "User 0",
+                "profile_image": "user.png",
+            },
+        ),
+        Endpoint(name="get_current_user", method="GET", route="/current_user"),
+        Endpoint(name="get_current_user_balances", method="GET", route="/current_user/balances"),
+        Endpoint(name="get_users", method="GET", route="/users", params={"limit": 100}),
+        Endpoint(name="get_images", method="GET", route="/images", params={"limit": 100}),
+        Endpoint(
+            name="get_image",
+            method="GET",
+            route="/images/{image_name}",
+            path_params={"image_name": "user.png"},
+        ),
+        Endpoint(name="get_groups", method="GET", route="/groups", params={"limit": 100}),
+        Endpoint(name="get_group", method="GET", route="/groups/{group_id}", path_params=group),
+        Endpoint(
+            name="get_group_members",
+            method="GET",
+            route="/groups/{group_id}/members",
+            path_params=group,
+        ),
+        Endpoint(
+            name="get_group_balance",
+            method="GET",
+            route="/groups/{group_id}/balance",
+            path_params=group,
+        ),
+        Endpoint(
+            name="get_group_overview",
+            method="GET",
+            route="/groups/{group_id}/overview",
+            path_params=group,
+        ),
+        Endpoint(
+            name="get_group_stats",
+            method="GET",
+            route="/groups/{group_id}/stats",
+            path_params=group,
+        ),
+        Endpoint(
+            name="get_group_settlement",
+            method="GET",
+            route="/groups/{group_id}/settlement",
+            path_params=group,
+        ),
+        Endpoint(
+            name="get_expenses",
+            method="GET",
+            route="/groups/{group_id}/expenses",
+            path_params=group,
+            params={"limit": 100},
+        ),
+        Endpoint(
+            name="search_expenses",
+            method="GET",
+            route="/groups/{group_id}/expenses/search",
+            path_params=group,
+            params={"q": "expense 1", "limit": 20},
+        ),
+        Endpoint(
+            name="get_expense",
+            method="GET",
+            route="/groups/{group_id}/expenses/{expense_id}",
+            path_params=expense,
+        ),
+        Endpoint(
+            name="get_expense_members",
+            method="GET",
+            route="/groups/{group_id}/expenses/{expense_id}/members",
+            path_params=expense,
+        ),
+        Endpoint(
+            name="get_transactions",
+            method="GET",
+            route="/groups/{group_id}/transactions",
+            path_params=group,
+            params={"limit": 100},
+        ),
+        Endpoint(
+            name="create_expense",
+            method="POST",
+            route="/groups/{group_id}/expenses",
+            path_params=group,
+            body={
+                "name": "Benchmark",
+                "description": "Benchmark expense",
+                "amount_in_cents": 100 * len(split),
+                "payer_username": BENCHMARK_USERNAME,
+                "members": [{"username": username, "amount_in_cents": 100} for username in split],
+            },
+        ),
+        Endpoint(
+            name="create_transaction",
+            method="POST",
+            route="/groups/{group_id}/transactions",
+            path_params=group,
+            params={"amount_in_cents": DEPOSIT_AMOUNT},
+        ),
+        Endpoint(
+            name="create_group",
+            method="POST",
+            route="/groups",
+            params={"name": "Benchmark {n}", "description": "Benchmark group", "currency_code": "USD"},
+        ),
+        Endpoint(
+            name="add_group_member",
+            method="POST",
+            route="/groups/{group_id}/members",
+            path_params=group,
+            params={"username": signup_username, "is_owner": "false"},
+        ),
+        Endpoint(
+            name="remove_group_member",
+            method="DELETE",
+            route="/groups/{group_id}/members/{username}",
+            path_params={**group, "username": signup_username},
+        ),
+    ]
+
+
+async def owe_group(client: httpx.AsyncClient, members: list[str], amount_in_cents: int) -> None:
+    """Make the benchmark user owe at least an amount in the first group
+
+    A deposit is rejected once it would pay more than the user owes, so the
+    debt is raised first, by an expense which another member pays for the user.
+    """
+    response = await client.get("/groups/1/members")
+    response.raise_for_status()
+    balance = next(
+        member["balance_amount_cents"]
+        for member in response.json()
+        if member["username"] == BENCHMARK_USERNAME
+    )
+    if balance + amount_in_cents <= 0:
+        return
+
+    response = await client.post(
+        "/groups/1/expenses",
+        json={
+            "name": "Benchmark debt",
+            "description": "Debt paid off by the benchmarked deposits",
+            "amount_in_cents": balance + amount_in_cents,
+            "payer_username": next(username for username in members if username != BENCHMARK_USERNAME),
+            "members": [{"username": BENCHMARK_USERNAME, "amount_in_cents": balance + amount_in_cents}],
+        },
+    )
+    response.raise_for_status()
+
+
+def create_database(directory: pathlib.Path) -> str:
+    """Create an empty database in a directory from the Prisma schema, and return its URL"""
+    database_url = f"file:{(directory / 'database.db').resolve()}"
+    schema = (pathlib.Path(app.__file__).parent.parent / "prisma" / "schema.prisma").read_text()
+    schema_path = directory / "schema.prisma"
+    schema_path.write_text(schema.replace('"file:database.db"', json.dumps(database_url)))
+
+    subprocess.run(
+        ["prisma", "db", "push", "--schema", str(schema_path), "--skip-generate"],  # noqa: S603, S607
+        check=True,
+        capture_output=True,
+    )
+    return database_url
+
+
+def percentile(quantiles: list[float], percent: int) -> float:
+    """Get a percentile from the output of `statistics.quantiles` with n=100"""
+    return quantiles[percent - 1]
+
+
+async def benchmark_endpoint(
+    client: httpx.AsyncClient,
+    endpoint: Endpoint,
+    requests: int,
+    warmup: int,
+    route_metrics: Callable[[str, str], tuple[float, float]],
+) -> EndpointResult:
+    """Send requests to an endpoint one at a time, and measure them
+
+    The query count and database time are read from the metrics of the route,
+    as recorded by the metrics middleware.
+    """
+    requests_sent = 0
+
+    async def send() -> httpx.Response:
+        nonlocal requests_sent
+        n = requests_sent
+        requests_sent += 1
+        return await client.request(
+            endpoint.method,
+            endpoint.route.format(**number_values(endpoint.path_params, n)),
+            params=number_values(endpoint.params, n),
+            data=number_values(endpoint.form, n) if endpoint.form else None,
+            json=endpoint.body,
+        )
+
+    for _ in range(warmup):
+        await send()
+
+    queries_before, db_seconds_before = route_metrics(endpoint.method, endpoint.route)
+    latencies = []
+    errors = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await send()
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= httpx.codes.BAD_REQUEST:
+            errors += 1
+    queries_after, db_seconds_after = route_metrics(endpoint.method, endpoint.route)
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return EndpointResult(
+        name=endpoint.name,
+        method=endpoint.method,
+        route=endpoint.route,
+        requests=requests,
+        errors=errors,
+        p50_ms=percentile(quantiles, 50),
+        p95_ms=percentile(quantiles, 95),
+        p99_ms=percentile(quantiles, 99),
+        mean_ms=statistics.fmean(latencies),
+        queries_per_request=(queries_after - queries_before) / requests,
+        db_ms_per_request=(db_seconds_after - db_seconds_before) * 1000 / requests,
+    )
+
+
+def get_commit() -> str | None:
+    """Get the commit of the repository, if it is a git checkout"""
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"],  # noqa: S603, S607
+        cwd=pathlib.Path(app.__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return result.stdout.strip() or None
+
+
+async def run(
+    directory: pathlib.Path,
+    scale: Scale,
+    seed: int,
+    requests: int,
+    warmup: int,
+) -> BenchmarkResult:
+    """Generate and seed a database in a directory, and benchmark every endpoint against it"""
+    # The settings are read when the app is imported, so they are set first. Every
+    # database file is kept in the benchmark directory, and passwords are hashed
+    # with the lowest bcrypt cost, so logins measure the app rather than bcrypt.
+    os.environ["XPENSE_BLOB_DIR"] = str(directory / "blobs")
+    os.environ.setdefault("XPENSE_BCRYPT_ROUNDS", "4")
+
+    from app.main import app as api
+    from app.utility import metrics, security
+    from app.utility.setup_db import register_prisma, seed_db
+
+    database_url = create_database(directory)
+    generate_seeds(directory / "seeds", scale, seed)
+
+    db = await register_prisma(database_url)
+    metrics.instrument_prisma(db)
+    try:
+        await seed_db(directory / "seeds")
+
+        def route_metrics(method: str, route: str) -> tuple[float, float]:
+            """Get the total queries and database time of a route"""
+            route_metrics = metrics.routes.get((method, route))
+            return (route_metrics.queries.sum, route_metrics.db_seconds) if route_metrics else (0, 0)
+
+        transport = httpx.ASGITransport(app=api)  # type: ignore[arg-type]
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            token = await client.post("/token", data={"username": BENCHMARK_USERNAME, "password": PASSWORD})
+            token.raise_for_status()
+            client.headers["Authorization"] = f"Bearer {token.json()['access_token']}"
+
+            group_members = json.loads((directory / "seeds" / "group_members.json").read_text())
+            members = [member["username"] for member in group_members if member["group_id"] == 1]
+
+            results = []
+            for endpoint in get_endpoints(scale, members):
+                # Every deposit has to pay off part of a debt, or it only measures the rejection
+                if endpoint.name == "create_transaction":
+                    await owe_group(client, members, (warmup + requests) * DEPOSIT_AMOUNT)
+                results.append(await benchmark_endpoint(client, endpoint, requests, warmup, route_metrics))
+    finally:
+        await db.disconnect()
+        security.password_pool.shutdown()
+
+    return BenchmarkResult(
+        commit=get_commit(),
+        created_at=datetime.datetime.now(tz=datetime.UTC),
+        scale=scale,
+        seed=seed,
+        requests=requests,
+        endpoints=results,
+    )
+
+
+def at_least(minimum: int) -> Callable[[str], int]:
+    """Get an argument type, which parses an integer of at least `minimum`"""
+
+    def parse(value: str) -> int:
+        number = int(value)
+        if number < minimum:
+            message = f"must be at least {minimum}"
+            raise argparse.ArgumentTypeError(message)
+        return number
+
+    return parse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the XPense API against a synthetic database")
+    # The requests are sent to the first expense of the first group, and the debt paid
+    # off by the deposits is paid by a second member, while percentiles need two samples
+    parser.add_argument("--groups", type=at_least(1), default=10, help="number of groups")
+    parser.add_argument("--members", type=at_least(2), default=10, help="members per group")
+    parser.add_argument("--expenses", type=at_least(1), default=100, help="expenses per group")
+    parser.add_argument("--split", type=at_least(1), default=3, help="members each expense is split between")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--requests", type=at_least(2), default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=at_least(0), default=10, help="unmeasured requests per endpoint")
+    parser.add_argument("--directory", type=pathlib.Path, help="keep the database in this directory")
+    parser.add_argument("--output", type=pathlib.Path, help="write the results to this file, not stdout")
+    args = parser.parse_args()
+
+    scale = Scale(groups=args.groups, members=args.members, expenses=args.expenses, split=args.split)
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = args.directory or pathlib.Path(temporary_directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        result = asyncio.run(run(directory, scale, args.seed, args.requests, args.warmup))
+
+    output = result.model_dump_json(indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
@@ -0,0 +1,97 @@
+"""Benchmark the serialization of a large expense list, by the default path of FastAPI and by FastJSONResponse
+
+Run it from the root of the repository:
+
+    python3 -m benchmarks.serialization --rows 10000
+"""
+import argparse
+import asyncio
+import datetime
+import statistics
+import sys
+import time
+from collections.abc import Awaitable, Callable
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from prisma.models import Expense
+from pydantic import BaseModel
+
+from app.utility.responses import FastJSONResponse
+
+
+class SerializationResult(BaseModel):
+    """The time taken to serialize the list, by each path"""
+
+    rows: int
+    runs: int
+    default_ms: float
+    fast_ms: float
+    speedup: float
+
+
+def get_expenses(rows: int) -> list[Expense]:
+    """Get a list of expenses, as they are returned by Prisma"""
+    date = datetime.datetime.now(tz=datetime.UTC)
+    return [
+        Expense(
+            id=i,
+            name=f"Expense {i}",
+            description=f"Synthetic expense {i}",
+            amount_in_cents=i * 100,
+            group_id=1,
+            payer_username=f"user{i % 20}",
+            date=date,
+        )
+        for i in range(1, rows + 1)
+    ]
+
+
+async def measure(render: Callable[[], Awaitable[bytes]], runs: int) -> float:
+    """Get the median time of rendering the body, in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await render()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def run(rows: int, runs: int) -> SerializationResult:
+    """Measure both paths on the same list of expenses"""
+    expenses = get_expenses(rows)
+    field = create_response_field(name="Response_get_expenses", type_=list[Expense])
+
+    async def default() -> bytes:
+        """Validate against the response model and encode with json, as FastAPI does for a returned list"""
+        content = await serialize_response(field=field, response_content=expenses)
+        return JSONResponse(content).body
+
+    async def fast() -> bytes:
+        """Serialize the models directly, as the list endpoints do"""
+        return FastJSONResponse(expenses).body
+
+    # Both paths must produce the same document
+    if await default() != await fast():
+        sys.stderr.write("The serialized lists differ\n")
+
+    default_ms = await measure(default, runs)
+    fast_ms = await measure(fast, runs)
+    return SerializationResult(
+        rows=rows,
+        runs=runs,
+        default_ms=default_ms,
+        fast_ms=fast_ms,
+        speedup=default_ms / fast_ms,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the serialization of a large expense list")
+    parser.add_argument("--rows", type=int, default=10_000, help="expenses in the list")
+    parser.add_argument("--runs", type=int, default=20, help="measured runs of each path")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.rows, args.runs))
+    sys.stdout.write(result.model_dump_json(indent=2) + "\n")
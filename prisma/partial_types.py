@@ -0,0 +1,8 @@
+"""Partial types of the Prisma models, which select a subset of the model fields"""
+from prisma.models import Image, User
+
+# The user resolved from an access token, which never needs the password hash
+User.create_partial("AuthenticatedUser", exclude=["hashed_password"], exclude_relational_fields=True)
+
+# The metadata of an image, so listing images never reads their data
+Image.create_partial("ImageMetadata", exclude=["data"], exclude_relational_fields=True)